@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from gradient_generator import gradient_generator as gen, cache as render_cache, animate, encode
+from playlist_data import playlist_data as pd, cache as playlist_cache, features as feature_store
+from benchmarks import fake_spotify
+
+'''
+Benchmarks for gradient rendering and the whole /playlist_img pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.bench --output results.json
+    python -m benchmarks.bench --compare results.json
+
+Groups:
+    gradients: every gen_linear_* generator at several image sizes
+    aggregate: get_avg_attr_data over synthetic feature lists
+    animations: 60-frame loops at the default animation size and 640x640,
+               rendering alone and encoded in each animated format
+    pipeline:  /playlist_img plus its four image requests, against a local
+               fake Spotify server (see benchmarks/fake_spotify.py)
+
+Results are written as JSON so runs from different commits can be compared
+with --compare.
+'''
+SIZES = [100, 300, 640, 3000]
+TRACK_COUNTS = [100, 1000, 10000, 50000]
+PLAYLIST_LENGTHS = [100, 2000]
+ANIMATION_SIZES = [animate.DEFAULT_SIZE, 640]
+
+# ==========
+#   TIMING
+# ==========
+
+def time_call(fn, repeat):
+    '''
+    Call fn `repeat` times and summarize the timings in milliseconds.
+    '''
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "repeat": repeat,
+        "min_ms": min(timings),
+        "median_ms": statistics.median(timings),
+        "mean_ms": statistics.fmean(timings),
+    }
+
+def result(group, name, params, timings):
+    return {"group": group, "name": name, "params": params, **timings}
+
+# ==============
+#   BENCHMARKS
+# ==============
+
+def bench_gradients(repeat):
+    '''
+    Time every generator with the render cache disabled.
+    '''
+    render_cache.configure(max_bytes=0)
+    attributes = (130.542, 0.350, 0.859, 0.000322)
+    c1, c2 = gen.attr_to_colors(*attributes)
+    names = sorted(name for name in dir(gen) if name.startswith("gen_linear_"))
+
+    results = []
+    for size in SIZES:
+        for name in names:
+            generator = getattr(gen, name)
+            if name.endswith("_from_attr"):
+                fn = lambda: generator(*attributes, size=size)
+            else:
+                fn = lambda: generator(c1, c2, size=size)
+            fn()
+            results.append(result("gradients", name, {"size": size}, time_call(fn, repeat)))
+    return results
+
+def bench_animations(repeat):
+    '''
+    Time animated gradients with the render cache disabled: the frames on
+    their own, then rendered and encoded in each animated format.
+    '''
+    render_cache.configure(max_bytes=0)
+    c1, c2 = gen.attr_to_colors(130.542, 0.350, 0.859, 0.000322)
+
+    results = []
+    for shape in ("conic", "radial"):
+        animation = animate.default_animation(shape)
+        for size in ANIMATION_SIZES:
+            params = {"shape": shape, "animation": animation, "size": size, "frames": animate.DEFAULT_FRAMES}
+            fn = lambda: sum(1 for _ in animate.iter_frames(shape, [c1, c2], animation, size=size))
+            fn()
+            results.append(result("animations", "frames", params, time_call(fn, repeat)))
+            for format in encode.ANIMATED_FORMATS:
+                encoding = encode.animation_encoding(format, speed="fast", quality=80 if format == "webp" else None)
+                fn = lambda: animate.render_animation(shape, c1, c2, 130.542, animation, size=size, encoding=encoding)
+                fn()
+                results.append(result("animations", f"render_animation_{format}", params, time_call(fn, repeat)))
+    return results
+
+def bench_aggregate(repeat):
+    '''
+    Time get_avg_attr_data on synthetic audio features.
+    '''
+    rng = random.Random(0)
+    results = []
+    for count in TRACK_COUNTS:
+        attributes = [
+            {"valence": rng.random(), "energy": rng.random(), "acousticness": rng.random(), "tempo": rng.uniform(60, 200)}
+            for _ in range(count)
+        ]
+        timings = time_call(lambda: pd.get_avg_attr_data(attributes), repeat)
+        results.append(result("aggregate", "get_avg_attr_data", {"tracks": count}, timings))
+    return results
+
+def bench_pipeline(repeat, latency):
+    '''
+    Time a full form submission plus its image requests against the fake
+    Spotify server, with cold and warm caches.
+    '''
+    import re
+    import main
+    from playlist_data import spotify
+    from gradient_generator.scheduler import render_scheduler
+
+    server = fake_spotify.start_server(latency=latency)
+    pd.sp = spotify.build_client("bench", "bench", api_url=f"{server.base_url}/v1/", token_url=f"{server.base_url}/api/token")
+    client = main.app.test_client()
+
+    def submit(playlist_id):
+        response = client.post("/playlist_img", data={"playlist_url": f"spotify:playlist:{playlist_id}"})
+        # the gradients, not the similar blends' swatches
+        urls = re.findall(r'<img class="gradient" src="([^"]+)"', response.get_data(as_text=True))
+        assert len(urls) == 4, "playlist_img didn't return four images"
+        for url in urls:
+            assert client.get(url).status_code == 200
+
+    def cold(playlist_id):
+        playlist_cache.configure()
+        feature_store.configure()
+        render_cache.configure(max_bytes=0)
+        submit(playlist_id)
+
+    results = []
+    try:
+        for length in PLAYLIST_LENGTHS:
+            playlist_id = f"bench{length}"
+            params = {"tracks": length, "latency_ms": latency * 1000}
+            results.append(result("pipeline", "playlist_img_cold", params, time_call(lambda: cold(playlist_id), repeat)))
+
+            playlist_cache.configure()
+            render_cache.configure()
+            submit(playlist_id)
+            results.append(result("pipeline", "playlist_img_warm", params, time_call(lambda: submit(playlist_id), repeat)))
+    finally:
+        server.shutdown()
+        render_scheduler.shutdown()
+    return results
+
+# ==========
+#   OUTPUT
+# ==========
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import numpy
+    return {
+        "commit": commit,
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "numpy": numpy.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def result_key(r):
+    return (r["group"], r["name"], json.dumps(r["params"], sort_keys=True))
+
+def compare(baseline, current):
+    '''
+    Print how each benchmark's median moved against a baseline run.
+    '''
+    before = {result_key(r): r for r in baseline["results"]}
+    print(f"{'benchmark':<60} {'before':>10} {'after':>10} {'change':>8}")
+    for r in current["results"]:
+        old = before.get(result_key(r))
+        label = f"{r['group']}/{r['name']} {r['params']}"
+        if old is None:
+            print(f"{label:<60} {'-':>10} {r['median_ms']:>9.2f}ms {'new':>8}")
+            continue
+        change = (r["median_ms"] - old["median_ms"]) / old["median_ms"] * 100
+        print(f"{label:<60} {old['median_ms']:>9.2f}ms {r['median_ms']:>9.2f}ms {change:>+7.1f}%")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark PlaylistBlender.")
+    parser.add_argument("--groups", default="gradients,aggregate,animations,pipeline", help="comma-separated groups to run")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds of fake Spotify latency per request")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare against results in this JSON file")
+    args = parser.parse_args(argv)
+
+    groups = args.groups.split(",")
+    results = []
+    if "gradients" in groups:
+        results.extend(bench_gradients(args.repeat))
+    if "aggregate" in groups:
+        results.extend(bench_aggregate(args.repeat))
+    if "animations" in groups:
+        results.extend(bench_animations(args.repeat))
+    if "pipeline" in groups:
+        results.extend(bench_pipeline(args.repeat, args.latency))
+
+    report = {"meta": metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    elif not args.output:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
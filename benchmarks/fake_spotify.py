@@ -0,0 +1,188 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import hashlib
+import json
+import re
+import threading
+import time
+
+'''
+A local stand-in for the parts of the Spotify Web API PlaylistBlender uses,
+for benchmarks and for exercising the client without real credentials.
+
+Playlists are synthetic: the playlist ID "bench2000" has 2,000 tracks, and
+every track's audio features are derived from a hash of its ID, so results
+are the same on every run. Albums work the same way ("bench30" has 30
+tracks), and every artist has ten top tracks.
+'''
+PAGE_SIZE = 100
+ALBUM_PAGE_SIZE = 50
+
+def track_id(playlist_id, index):
+    return f"{playlist_id}t{index:06d}"
+
+def fake_features(track):
+    '''
+    Deterministic audio features for a track ID.
+    '''
+    digest = hashlib.sha256(track.encode("utf-8")).digest()
+    return {
+        "id": track,
+        "uri": f"spotify:track:{track}",
+        "valence": digest[0] / 255,
+        "energy": digest[1] / 255,
+        "acousticness": digest[2] / 255,
+        "tempo": 60 + digest[3] / 255 * 140,
+    }
+
+def playlist_length(playlist_id):
+    '''
+    Number of tracks in a synthetic playlist: the digits its ID ends with.
+    '''
+    digits = re.search(r"(\d+)$", playlist_id)
+    return int(digits.group(1)) if digits else PAGE_SIZE
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        return
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            rate_limited = server.rate_limit_every and server.requests % server.rate_limit_every == 0
+            failed = server.error_every and server.requests % server.error_every == 0
+        if server.latency:
+            time.sleep(server.latency)
+        if rate_limited:
+            return self.send_json({"error": {"status": 429, "message": "API rate limit exceeded"}}, status=429, headers={"Retry-After": "0"})
+        if failed:
+            return self.send_json({"error": {"status": 503, "message": "Service unavailable"}}, status=503)
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+
+        if parts[:2] == ["v1", "playlists"] and len(parts) == 3:
+            return self.send_json(self.playlist(parts[2]))
+        if parts[:2] == ["v1", "playlists"] and len(parts) == 4 and parts[3] in ("tracks", "items"):
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", [str(PAGE_SIZE)])[0])
+            return self.send_json(self.page(parts[2], offset, limit))
+        if parts[:2] == ["v1", "albums"] and len(parts) == 2:
+            ids = query.get("ids", [""])[0].split(",")
+            return self.send_json({"albums": [self.album(album_id) for album_id in ids if album_id]})
+        if parts[:2] == ["v1", "albums"] and len(parts) == 4 and parts[3] == "tracks":
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", [str(ALBUM_PAGE_SIZE)])[0])
+            return self.send_json(self.album_page(parts[2], offset, limit))
+        if parts[:2] == ["v1", "tracks"] and len(parts) == 2:
+            ids = query.get("ids", [""])[0].split(",")
+            return self.send_json({"tracks": [self.track(track) for track in ids if track]})
+        if parts[:2] == ["v1", "artists"] and len(parts) == 4 and parts[3] == "top-tracks":
+            artist = {"id": parts[2], "name": f"Benchmark artist {parts[2]}"}
+            return self.send_json({"tracks": [self.track(track_id(parts[2], i), artist) for i in range(10)]})
+        if parts[:2] == ["v1", "audio-features"]:
+            ids = query.get("ids", [""])[0].split(",")
+            return self.send_json({"audio_features": [fake_features(track) for track in ids if track]})
+        self.send_json({"error": {"status": 404, "message": "Not found"}}, status=404)
+
+    def do_POST(self):
+        # client-credentials token endpoint
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        with self.server.lock:
+            self.server.token_requests += 1
+        self.send_json({"access_token": "fake-token", "token_type": "Bearer", "expires_in": self.server.token_lifetime})
+
+    def playlist(self, playlist_id):
+        return {
+            "id": playlist_id,
+            "name": f"Benchmark playlist {playlist_id}",
+            "owner": {"display_name": "benchmarks"},
+            "snapshot_id": f"{playlist_id}snapshot",
+            "tracks": self.page(playlist_id, 0, PAGE_SIZE),
+        }
+
+    def album(self, album_id):
+        return {
+            "id": album_id,
+            "name": f"Benchmark album {album_id}",
+            "artists": [{"name": "benchmarks"}],
+            "tracks": self.album_page(album_id, 0, ALBUM_PAGE_SIZE),
+        }
+
+    def album_page(self, album_id, offset, limit):
+        total = playlist_length(album_id)
+        end = min(total, offset + limit)
+        return {
+            "items": [{"id": track_id(album_id, i), "uri": f"spotify:track:{track_id(album_id, i)}"} for i in range(offset, end)],
+            "offset": offset,
+            "limit": limit,
+            "total": total,
+        }
+
+    def track(self, track, artist=None):
+        return {
+            "id": track,
+            "uri": f"spotify:track:{track}",
+            "name": f"Benchmark track {track}",
+            "artists": [artist or {"name": "benchmarks"}],
+        }
+
+    def page(self, playlist_id, offset, limit):
+        total = playlist_length(playlist_id)
+        end = min(total, offset + limit)
+        items = [{"track": {"uri": f"spotify:track:{track_id(playlist_id, i)}"}} for i in range(offset, end)]
+        return {
+            "items": items,
+            "offset": offset,
+            "limit": limit,
+            "total": total,
+            "next": None if end >= total else f"{self.server.base_url}/v1/playlists/{playlist_id}/tracks?offset={end}&limit={limit}",
+        }
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_server(latency=0.0, rate_limit_every=0, error_every=0, token_lifetime=3600):
+    '''
+    Start a fake Spotify API on a free local port in a background thread.
+
+    latency: seconds to sleep before answering each GET
+    rate_limit_every: answer every Nth GET with a 429 (0 never does)
+    error_every: answer every Nth GET with a 503 (0 never does)
+    token_lifetime: expires_in of issued tokens, in seconds
+
+    Returns the server; its base_url attribute is the API root, and
+    server.shutdown() stops it. Any POST is answered as the token endpoint.
+    server.requests, server.token_requests and server.connections count
+    what it's been sent.
+    '''
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSpotifyHandler)
+    server.daemon_threads = True
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.latency = latency
+    server.rate_limit_every = rate_limit_every
+    server.error_every = error_every
+    server.token_lifetime = token_lifetime
+    server.requests = 0
+    server.token_requests = 0
+    server.connections = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
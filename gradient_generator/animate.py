@@ -0,0 +1,181 @@
+import io
+import numpy as np
+from math import isfinite, pi
+from gradient_generator import engine, cache, encode, fields
+from gradient_generator import gradient_generator as gen
+from instrumentation import instrumentation as inst
+
+'''
+Animated gradients that move in time with a playlist's tempo: "rotate"
+turns the gradient once per loop (a spinning conic gradient), and "pulse"
+swells it out from its 1.0 end and back once per beat (a throbbing radial
+one).
+
+The geometry is built once per animation: every pixel's parameter value is
+quantized to one of LUT_SIZE levels, giving a level map (from the field
+cache when the size has a cached field). Both animations only move colors
+along the parameter axis, so a frame is just a per-frame color table of
+LUT_SIZE entries, remapped from the still image's, looked up through that
+map. Nothing per pixel is computed more than once, and frames are made one
+at a time as the encoder asks for them (see encode.encode_animation).
+
+A loop is `beats` beats long, split into `frames` frames, so at 120 BPM the
+default 60 frames over 4 beats are 33 ms each. Animations are DEFAULT_SIZE
+pixels a side unless asked otherwise, smaller than still images: a gradient
+has no detail to lose when the browser scales it up, and encoding time goes
+with the pixel count.
+'''
+DEFAULT_FRAMES = 60
+MAX_FRAMES = 240
+DEFAULT_SIZE = 480
+DEFAULT_BEATS = 4
+MAX_BEATS = 32
+
+# frame durations are clamped to this range in milliseconds; browsers slow
+# down anything faster than 20 ms, and APNG can't store more than 65535
+MIN_DURATION = 20
+MAX_DURATION = 65535
+
+# lossy animated WebP: lossless loops are several times the size and take
+# seconds to encode. Even lossy, encoding is most of the time a loop takes
+# (about 0.4 s at the default size); APNG is a little faster and GIF near
+# instant, but their files are ten times the size or more.
+DEFAULT_ENCODING = {"format": "webp", "speed": "fast", "quality": 80, "palette": False}
+
+# a pulse raises the parameter to a power swinging between 1 / PULSE_DEPTH
+# and PULSE_DEPTH, which keeps both ends of the gradient in place
+PULSE_DEPTH = 2.0
+
+# ==============
+#   TRANSFORMS
+# ==============
+
+# Every transform takes the positions of the color table's entries (0.0 to
+# 1.0), how far through the loop the frame is (0.0 to 1.0) and the beats per
+# loop, and returns the position each entry takes its color from.
+
+def rotate(x, phase, beats):
+    '''
+    Shift the gradient along its parameter, wrapping around, once per loop.
+    '''
+    # not a plain modulo, so the first frame keeps its 1.0 end
+    return np.where(x >= phase, x - phase, x - phase + 1.0)
+
+def pulse(x, phase, beats):
+    '''
+    Push the gradient's colors toward its 0.0 end and back, once per beat.
+    '''
+    return x ** (PULSE_DEPTH ** np.sin(2 * pi * phase * beats))
+
+ANIMATIONS = {
+    "rotate": rotate,
+    "pulse": pulse,
+}
+
+# the animation a shape gets unless one is asked for
+DEFAULT_ANIMATIONS = {"conic": "rotate"}
+
+def default_animation(shape) -> str:
+    return DEFAULT_ANIMATIONS.get(shape, "pulse")
+
+# ==========
+#   FRAMES
+# ==========
+
+def level_map(shape, height, width, levels=engine.LUT_SIZE):
+    '''
+    Quantize a shape's parameter field to `levels` levels.
+
+    Returns a (height, width) uint16 array.
+    '''
+    scale = levels - 1
+    field = fields.field_cache.get(shape, height, width)
+    if field is not None:
+        values, index = field
+        return np.take((values * scale + 0.5).astype(np.uint16), index)
+    a = np.empty((height, width), dtype=np.uint16)
+    for row_start, row_stop in engine.bands(height, width):
+        a[row_start:row_stop] = engine.param_field(shape, height, width, row_start, row_stop) * scale + 0.5
+    return a
+
+def frame_luts(colors, animation, frames, beats, interp="hsv", levels=engine.LUT_SIZE):
+    '''
+    Yield each frame's (levels, 3) uint8 color table, in order.
+    '''
+    if animation not in ANIMATIONS:
+        raise ValueError(f"Unknown animation: {animation}")
+    transform = ANIMATIONS[animation]
+    lut = engine.color_lut(engine.ramp_color_band(colors, interp), levels)
+    scale = levels - 1
+    x = np.arange(levels, dtype=np.float64) / scale
+    for frame in range(frames):
+        source = transform(x, frame / frames, beats)
+        yield np.take(lut, (source * scale + 0.5).astype(np.intp), axis=0)
+
+def iter_frames(shape, colors, animation, frames=DEFAULT_FRAMES, beats=DEFAULT_BEATS, interp="hsv", size=None):
+    '''
+    Yield each frame of an animation as a (height, width, 3) uint8 array,
+    rendering them one at a time.
+    '''
+    height, width = gen.resolve_size(size or DEFAULT_SIZE)
+    levels = level_map(shape, height, width)
+    for lut in frame_luts(colors, animation, frames, beats, interp):
+        yield np.take(lut, levels, axis=0)
+
+def frame_duration(tempo, frames=DEFAULT_FRAMES, beats=DEFAULT_BEATS) -> int:
+    '''
+    Get how long each frame shows, in milliseconds, for a loop of `beats`
+    beats at `tempo` BPM.
+    '''
+    if not (tempo > 0 and isfinite(tempo)):
+        raise ValueError("Tempo must be a positive number")
+    return min(MAX_DURATION, max(MIN_DURATION, round(beats * 60000 / tempo / frames)))
+
+# ==========
+#   RENDER
+# ==========
+
+def check_options(animation, frames, beats):
+    if animation not in ANIMATIONS:
+        raise ValueError(f"Unknown animation: {animation}")
+    if not 2 <= frames <= MAX_FRAMES:
+        raise ValueError(f"Frames must be between 2 and {MAX_FRAMES}")
+    if not 1 <= beats <= MAX_BEATS:
+        raise ValueError(f"Beats must be between 1 and {MAX_BEATS}")
+
+def animation_key(shape, c1, c2, tempo, animation, frames=DEFAULT_FRAMES, beats=DEFAULT_BEATS, interp="hsv", size=None, encoding=None) -> str:
+    '''
+    Get the cache key of an animation. Tempos that give the same frame
+    duration share a key.
+    '''
+    encoding = encoding or DEFAULT_ENCODING
+    timing = f"{animation}={frames}x{frame_duration(tempo, frames, beats)}ms/{beats}"
+    return cache.cache_key(shape, c1, c2, gen.resolve_size(size or DEFAULT_SIZE), f"{encode.encoding_key(encoding)};{timing}", interp)
+
+def render_animation(shape, c1, c2, tempo, animation=None, frames=DEFAULT_FRAMES, beats=DEFAULT_BEATS, interp="hsv", size=None, encoding=None) -> io.BytesIO():
+    '''
+    Render a looping animation of a two-color gradient at `tempo` BPM,
+    going through the render cache like gen.render. The animation defaults
+    to the shape's (see DEFAULT_ANIMATIONS), the size to DEFAULT_SIZE and
+    the encoding to lossy animated WebP (see encode.animation_encoding).
+
+    Returns image data in BytesIO object.
+    '''
+    animation = animation or default_animation(shape)
+    check_options(animation, frames, beats)
+    encoding = encoding or DEFAULT_ENCODING
+    height, width = gen.resolve_size(size or DEFAULT_SIZE)
+    key = animation_key(shape, c1, c2, tempo, animation, frames, beats, interp, (height, width), encoding)
+    data = cache.render_cache.get(key)
+    if data is None:
+        inst.count("render_cache", result="miss")
+        # frames are rendered as the encoder takes them, so this times both
+        with inst.timer("animate"):
+            levels = level_map(shape, height, width)
+            luts = frame_luts([c1, c2], animation, frames, beats, interp)
+            data = encode.encode_animation(levels, luts, frames, frame_duration(tempo, frames, beats), encoding)
+        inst.count("bytes_encoded", len(data))
+        cache.render_cache.put(key, data)
+    else:
+        inst.count("render_cache", result="hit")
+    return io.BytesIO(data)
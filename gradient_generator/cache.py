@@ -0,0 +1,149 @@
+from collections import OrderedDict
+from os import getenv
+import hashlib
+import os
+import tempfile
+import threading
+
+'''
+Content-addressed cache for rendered gradients.
+
+Renders are keyed on the resolved generator inputs (shape, interpolation,
+c1, c2, size, format) rather than on the playlist, so every playlist that
+lands on the same colors shares one entry. Entries live in an in-memory LRU
+bounded by a byte budget, and optionally in a directory on disk so a restarted
+worker starts warm.
+
+Configured with environment variables:
+    RENDER_CACHE_BYTES: in-memory budget in bytes (0 disables the memory tier)
+    RENDER_CACHE_DIR: directory for the on-disk tier (unset disables it)
+'''
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# HSV floats are rounded to this many decimals before hashing. Attribute
+# averages are already rounded to 3 decimals, so this only merges inputs
+# that differ by float noise.
+KEY_PRECISION = 6
+
+def cache_key(shape, c1, c2, size, format, interp="hsv", stops=()) -> str:
+    '''
+    Hash the resolved generator inputs into a hex digest. stops are the
+    colors between c1 and c2 on a multi-color ramp.
+    '''
+    parts = [shape, interp]
+    parts.extend(f"{x:.{KEY_PRECISION}f}" for x in c1)
+    parts.extend(f"{x:.{KEY_PRECISION}f}" for x in c2)
+    parts.append(f"{size[0]}x{size[1]}")
+    parts.append(format.lower())
+    for stop in stops:
+        parts.extend(f"{x:.{KEY_PRECISION}f}" for x in stop)
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+class RenderCache:
+    '''
+    LRU cache of encoded image bytes bounded by their total size, with an
+    optional on-disk tier. Safe to share between request threads.
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        '''
+        Get the bytes stored for a key, or None.
+        '''
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return data
+
+        data = self._disk_read(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, data)
+        return data
+
+    def put(self, key, data):
+        '''
+        Store bytes for a key in memory and, if enabled, on disk.
+        '''
+        with self._lock:
+            self._store(key, data)
+        self._disk_write(key, data)
+
+    def clear(self):
+        '''
+        Drop every in-memory entry. The disk tier is left alone.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _store(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._entries[key] = data
+        self.size += len(data)
+
+        # evict least recently used entries until we're back under budget
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _disk_read(self, key):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _disk_write(self, key, data):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write to a temp file first so readers never see a partial image
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+render_cache = RenderCache(
+    max_bytes=int(getenv("RENDER_CACHE_BYTES", DEFAULT_MAX_BYTES)),
+    disk_dir=getenv("RENDER_CACHE_DIR"),
+)
+
+def configure(max_bytes=DEFAULT_MAX_BYTES, disk_dir=None):
+    '''
+    Replace the process-wide render cache.
+    '''
+    global render_cache
+    render_cache = RenderCache(max_bytes=max_bytes, disk_dir=disk_dir)
+    return render_cache
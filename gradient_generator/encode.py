@@ -0,0 +1,289 @@
+import functools
+import io
+import struct
+import zlib
+
+'''
+Image encoders for rendered gradients.
+
+An encoding is a small dict describing how to turn a uint8 image array into
+bytes:
+    format:  "png", "webp", "jpeg" (or "avif" where Pillow supports it)
+    speed:   "fast", "balanced" or "small", trading encode time for file size
+    quality: 1-100 for lossy output; None keeps PNG/WebP lossless
+    palette: quantize to an adaptive 256-color palette first (PNG/WebP only);
+             two-color gradients barely change and files shrink several times
+
+The default encoding produces exactly the same PNG bytes as before encoders
+were configurable.
+
+Pillow is only imported once something is encoded or formats are checked,
+so importing this module stays cheap.
+
+Animations (see animate.py) are encoded as animated WebP, APNG or GIF, one
+frame at a time, so a loop never needs all of its frames in memory.
+'''
+CONTENT_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+    "jpeg": "image/jpeg",
+    "avif": "image/avif",
+    "gif": "image/gif",
+}
+SPEEDS = ("fast", "balanced", "small")
+DEFAULT_JPEG_QUALITY = 90
+
+# formats picked by content negotiation, most preferred first. Only lossless
+# ones, so a negotiated image always has the same pixels.
+NEGOTIABLE = ("webp", "png")
+
+# zlib level and strategy per speed; "balanced" is Pillow's default
+PNG_SPEEDS = {
+    "fast": {"compress_level": 1, "compress_type": zlib.Z_RLE},
+    "balanced": {},
+    "small": {"compress_level": 9},
+}
+# libwebp effort per speed
+WEBP_METHODS = {"fast": 0, "balanced": 4, "small": 6}
+
+# animated formats, "png" being APNG
+ANIMATED_FORMATS = ("webp", "png", "gif")
+# zlib level per speed for APNG frames
+APNG_LEVELS = {"fast": 1, "balanced": 6, "small": 9}
+
+@functools.cache
+def available_formats():
+    from PIL import features
+    formats = ["png", "jpeg"]
+    if features.check("webp"):
+        formats.append("webp")
+    if features.check("avif"):
+        formats.append("avif")
+    return tuple(formats)
+
+def encoding(format="png", speed="balanced", quality=None, palette=False) -> dict:
+    '''
+    Build and validate an encoding. Raises ValueError for unsupported options.
+    '''
+    format = format.lower()
+    if format == "jpg":
+        format = "jpeg"
+    if format not in available_formats():
+        raise ValueError(f"Unsupported image format: {format}")
+    if speed not in SPEEDS:
+        raise ValueError(f"Unknown encoder speed: {speed}")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("Quality must be between 1 and 100")
+    if format == "jpeg" and quality is None:
+        quality = DEFAULT_JPEG_QUALITY
+    return {"format": format, "speed": speed, "quality": quality, "palette": bool(palette) and format != "jpeg"}
+
+# same as encoding(), without checking formats (and so importing Pillow)
+DEFAULT_ENCODING = {"format": "png", "speed": "balanced", "quality": None, "palette": False}
+
+def encoding_key(options) -> str:
+    '''
+    A short string identifying an encoding, for cache keys. The default PNG
+    encoding is just "png" so keys from before encoders existed still match.
+    '''
+    parts = [options["format"]]
+    if options["speed"] != "balanced":
+        parts.append(f"speed={options['speed']}")
+    if options["quality"] is not None:
+        parts.append(f"q={options['quality']}")
+    if options["palette"]:
+        parts.append("palette")
+    return ";".join(parts)
+
+def encode(a, options=DEFAULT_ENCODING) -> bytes:
+    '''
+    Encode an image array.
+    '''
+    from PIL import Image
+    img = Image.fromarray(a)
+    if options["palette"]:
+        img = img.quantize(256, method=Image.Quantize.FASTOCTREE)
+
+    format = options["format"]
+    kwargs = {}
+    if format == "png":
+        kwargs.update(PNG_SPEEDS[options["speed"]])
+    elif format == "webp":
+        kwargs["method"] = WEBP_METHODS[options["speed"]]
+        if options["quality"] is None:
+            kwargs["lossless"] = True
+        else:
+            kwargs["quality"] = options["quality"]
+    elif format == "jpeg":
+        kwargs["quality"] = options["quality"]
+        kwargs["optimize"] = options["speed"] == "small"
+    elif options["quality"] is not None:
+        kwargs["quality"] = options["quality"]
+
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format=format.upper(), **kwargs)
+    return img_bytes.getvalue()
+
+def negotiate(accept_mimetypes, default="png", formats=None) -> str:
+    '''
+    Pick a lossless format from a request's Accept header (a werkzeug
+    MIMEAccept), falling back to the default. Only formats Pillow can write
+    are offered, unless the candidates are given as formats, which picks
+    without importing Pillow.
+    '''
+    formats = available_formats() if formats is None else formats
+    offered = [format for format in NEGOTIABLE if format in formats]
+    best = accept_mimetypes.best_match([CONTENT_TYPES[format] for format in offered])
+    if best is None:
+        return default
+    return next(format for format in offered if CONTENT_TYPES[format] == best)
+
+# ==============
+#   ANIMATIONS
+# ==============
+
+# An animation is a level map, the (height, width) index of every pixel
+# into a color table, plus one color table per frame. Frames are never
+# stored: each one is looked up from its table as the encoder reaches it.
+
+def animation_encoding(format="webp", speed="balanced", quality=None) -> dict:
+    '''
+    Build and validate an encoding for an animation. quality only applies to
+    WebP; None keeps it lossless. Raises ValueError for unsupported options.
+    '''
+    format = format.lower()
+    if format == "apng":
+        format = "png"
+    if format not in ANIMATED_FORMATS or (format == "webp" and format not in available_formats()):
+        raise ValueError(f"Unsupported animation format: {format}")
+    if speed not in SPEEDS:
+        raise ValueError(f"Unknown encoder speed: {speed}")
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError("Quality must be between 1 and 100")
+    return {"format": format, "speed": speed, "quality": quality if format == "webp" else None, "palette": False}
+
+def encode_animation(levels, luts, count, duration, options) -> bytes:
+    '''
+    Encode a looping animation of count frames, duration milliseconds each.
+    levels is a (height, width) array of indices into every color table, and
+    luts an iterable of count (entries, 3) uint8 color tables, one per frame.
+    '''
+    writers = {"webp": write_webp, "png": write_apng, "gif": write_gif}
+    out = io.BytesIO()
+    writers[options["format"]](out, levels, luts, count, duration, options)
+    return out.getvalue()
+
+def png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def png_scanlines(a):
+    '''
+    Filter an RGB image's rows with PNG's Sub filter, which turns a smooth
+    gradient into runs of small deltas that compress well.
+    '''
+    import numpy as np
+    height, width, _ = a.shape
+    rows = a.reshape(height, width * 3)
+    out = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    out[:, 0] = 1
+    out[:, 1:4] = rows[:, :3]
+    np.subtract(rows[:, 3:], rows[:, :-3], out=out[:, 4:])
+    return out.tobytes()
+
+def write_apng(fp, levels, luts, count, duration, options):
+    import numpy as np
+    height, width = levels.shape
+    fp.write(b"\x89PNG\r\n\x1a\n")
+    fp.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    fp.write(png_chunk(b"acTL", struct.pack(">II", count, 0)))
+    sequence = 0
+    for frame, lut in enumerate(luts):
+        fp.write(png_chunk(b"fcTL", struct.pack(">IIIIIHHBB", sequence, width, height, 0, 0, duration, 1000, 0, 0)))
+        sequence += 1
+        data = zlib.compress(png_scanlines(np.take(lut, levels, axis=0)), APNG_LEVELS[options["speed"]])
+        if frame == 0:
+            # the first frame doubles as the still image
+            fp.write(png_chunk(b"IDAT", data))
+        else:
+            fp.write(png_chunk(b"fdAT", struct.pack(">I", sequence) + data))
+            sequence += 1
+    fp.write(png_chunk(b"IEND", b""))
+
+def write_gif(fp, levels, luts, count, duration, options):
+    '''
+    Every frame has the same pixels, levels bucketed into 256 palette
+    indices, and only its local color table changes. The pixels are
+    LZW-compressed once and repeated for every frame.
+    '''
+    import numpy as np
+    from PIL import Image, GifImagePlugin
+    height, width = levels.shape
+    entries = None
+    image_data = None
+    fp.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0))
+    # loop forever
+    fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00")
+    for lut in luts:
+        if image_data is None:
+            entries = len(lut)
+            indices = (levels.astype(np.uint32) * 256 // entries).astype(np.uint8)
+            # skip the 10-byte image descriptor; the LZW data follows
+            image_data = b"".join(GifImagePlugin.getdata(Image.frombytes("P", (width, height), indices.tobytes())))[10:]
+            centers = (np.arange(256) * entries + entries // 2) // 256
+        # graphic control extension: delay in hundredths of a second
+        fp.write(b"!\xf9\x04\x00" + struct.pack("<H", round(duration / 10)) + b"\x00\x00")
+        # image descriptor with a 256-entry local color table
+        fp.write(b"," + struct.pack("<HHHHB", 0, 0, width, height, 0x87))
+        fp.write(np.ascontiguousarray(lut[centers]).tobytes())
+        fp.write(image_data)
+    fp.write(b";")
+
+def riff_chunk(tag, data):
+    # chunks are padded to an even length
+    return tag + struct.pack("<I", len(data)) + data + b"\0" * (len(data) & 1)
+
+def riff_chunks(data):
+    '''
+    Split a RIFF container's payload into (tag, data) chunks.
+    '''
+    chunks = []
+    offset = 0
+    while offset + 8 <= len(data):
+        tag, size = data[offset:offset + 4], struct.unpack("<I", data[offset + 4:offset + 8])[0]
+        chunks.append((tag, data[offset + 8:offset + 8 + size]))
+        offset += 8 + size + (size & 1)
+    return chunks
+
+def write_webp(fp, levels, luts, count, duration, options):
+    '''
+    Every frame is encoded as a still WebP and muxed into the animation as
+    a whole-canvas keyframe. libwebp's animation encoder also tries each
+    frame as a diff against the last and keeps the smaller, which more than
+    doubles the encode time for a gradient, whose colors move everywhere at
+    once.
+    '''
+    import numpy as np
+    from PIL import Image
+    height, width = levels.shape
+    kwargs = {"method": WEBP_METHODS[options["speed"]]}
+    if options["quality"] is None:
+        kwargs["lossless"] = True
+    else:
+        kwargs["quality"] = options["quality"]
+    # x and y offsets (in units of 2), width - 1, height - 1 and duration,
+    # 24 bits each, then "don't blend" and "don't dispose"
+    frame_header = struct.pack("<I", 0)[:3] * 2 + struct.pack("<I", width - 1)[:3] + struct.pack("<I", height - 1)[:3]
+    frame_header += struct.pack("<I", duration)[:3] + b"\x02"
+    frames = []
+    for lut in luts:
+        still = io.BytesIO()
+        Image.fromarray(np.take(lut, levels, axis=0)).save(still, format="WEBP", **kwargs)
+        # keep the image chunks (VP8 or VP8L), not the RIFF header or VP8X
+        image = b"".join(riff_chunk(tag, data) for tag, data in riff_chunks(still.getvalue()[12:]) if tag in (b"VP8 ", b"VP8L"))
+        frames.append(riff_chunk(b"ANMF", frame_header + image))
+    # animation flag, then canvas width - 1 and height - 1
+    vp8x = riff_chunk(b"VP8X", struct.pack("<I", 0x02) + struct.pack("<I", width - 1)[:3] + struct.pack("<I", height - 1)[:3])
+    # white background, loop forever
+    anim = riff_chunk(b"ANIM", b"\xff\xff\xff\xff" + struct.pack("<H", 0))
+    body = b"WEBP" + vp8x + anim + b"".join(frames)
+    fp.write(b"RIFF" + struct.pack("<I", len(body)) + body)
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from gradient_generator import engine
+from instrumentation import instrumentation as inst
+from os import getenv
+import numpy as np
+import os
+import tempfile
+import threading
+
+'''
+Cache of indexed parameter fields (see engine.index_field), keyed on shape and
+size. A field only depends on the geometry, never on the colors, so it's built
+once and every later render at that size is a color lookup over it.
+
+A field costs two bytes a pixel (a uint16 index) plus its distinct values;
+fields with too many of those to index share one table of quantized levels
+instead (see engine.index_field), which isn't counted against them.
+
+Fields are kept in an in-memory LRU bounded by a byte budget. With a cache
+directory, they are also saved as .npy files and memory-mapped back, so every
+render worker on the host shares one copy through the page cache.
+
+Images over FIELD_CACHE_MAX_PIXELS are rendered straight from the analytic
+field in bands instead, since building their index would need the whole
+float64 field in memory at once.
+
+Configured with environment variables:
+    FIELD_CACHE_BYTES: in-memory budget in bytes (0 disables the cache)
+    FIELD_CACHE_DIR: directory of memory-mapped fields (unset disables it)
+    FIELD_CACHE_MAX_PIXELS: largest image, in pixels, to cache fields for
+'''
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_PIXELS = 1024 * 1024
+
+def field_nbytes(field):
+    values, index = field
+    if values is engine.LEVEL_VALUES:
+        return index.nbytes
+    return values.nbytes + index.nbytes
+
+class FieldCache:
+    '''
+    LRU cache of indexed fields bounded by their total size, with an optional
+    directory of memory-mapped fields. Safe to share between threads.
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, disk_dir=None, max_pixels=DEFAULT_MAX_PIXELS):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_pixels = max_pixels
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.builds = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, shape, height, width):
+        '''
+        Get the indexed field for a shape and size, building it on a miss.
+        Returns None when the image is too big to cache a field for.
+        '''
+        if self.max_bytes <= 0 or height * width > self.max_pixels:
+            return None
+
+        key = (shape, height, width)
+        with self._lock:
+            field = self._entries.get(key)
+            if field is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                inst.count("field_cache", result="hit")
+                return field
+
+        field = self._disk_read(key)
+        if field is not None:
+            result = "disk_hit"
+        else:
+            result = "build"
+            with inst.timer("field_build"):
+                field = engine.index_field(np.ascontiguousarray(engine.param_field(shape, height, width)))
+            self._disk_write(key, field)
+        inst.count("field_cache", result=result)
+
+        with self._lock:
+            if result == "disk_hit":
+                self.disk_hits += 1
+            else:
+                self.builds += 1
+            self._store(key, field)
+        return field
+
+    def clear(self):
+        '''
+        Drop every in-memory field. The directory is left alone.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _store(self, key, field):
+        nbytes = field_nbytes(field)
+        if nbytes > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= field_nbytes(old)
+        self._entries[key] = field
+        self.size += nbytes
+
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= field_nbytes(evicted)
+
+    def _disk_paths(self, key):
+        shape, height, width = key
+        base = os.path.join(self.disk_dir, f"{shape}-{height}x{width}")
+        return (f"{base}.values.npy", f"{base}.index.npy")
+
+    def _disk_read(self, key):
+        if not self.disk_dir:
+            return None
+        values_path, index_path = self._disk_paths(key)
+        try:
+            values = np.load(values_path, mmap_mode="r")
+            index = np.load(index_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        # exact values are float64; float32 ones are the shared levels
+        if values.dtype == np.float32:
+            values = engine.LEVEL_VALUES
+        return (values, index)
+
+    def _disk_write(self, key, field):
+        if not self.disk_dir:
+            return
+        # the index goes last, so a field whose index exists is complete
+        for path, array in zip(self._disk_paths(key), field):
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".npy")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp_path, path)
+            except OSError:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+
+field_cache = FieldCache(
+    max_bytes=int(getenv("FIELD_CACHE_BYTES", DEFAULT_MAX_BYTES)),
+    disk_dir=getenv("FIELD_CACHE_DIR"),
+    max_pixels=int(getenv("FIELD_CACHE_MAX_PIXELS", DEFAULT_MAX_PIXELS)),
+)
+
+def configure(max_bytes=DEFAULT_MAX_BYTES, disk_dir=None, max_pixels=DEFAULT_MAX_PIXELS):
+    '''
+    Replace the process-wide field cache.
+    '''
+    global field_cache
+    field_cache = FieldCache(max_bytes=max_bytes, disk_dir=disk_dir, max_pixels=max_pixels)
+    return field_cache
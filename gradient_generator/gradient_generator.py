@@ -1,15 +1,21 @@
-import numpy as np
 from PIL import Image
-import colorsys
+import base64
 import io
-from math import sqrt, atan2, pi
+import struct
+from gradient_generator import engine, cache, encode, fields
+from instrumentation import instrumentation as inst
 
 '''
-We will be generating 300x300 PNG images in RGB.
+We will be generating PNG images in RGB, 300x300 by default. Every generator
+also takes a size: an int for square images or a (height, width) tuple,
+anywhere from MIN_SIZE to MAX_SIZE pixels a side (640 is Spotify's largest
+cover size, 3000 is for print).
 '''
 HEIGHT = 300
 WIDTH = 300
 RGB_VAL = 3
+MIN_SIZE = 16
+MAX_SIZE = 3000
 
 def __init__():
     return
@@ -52,293 +58,238 @@ def attr_to_gen_input(tempo, valence, energy, acousticness) -> tuple[list[float]
 
     return ([hue, saturation, value], range)
 
+def attr_to_colors(tempo, valence, energy, acousticness) -> tuple[list[float], list[float]]:
+    '''
+    Turn Spotify song attributes into the two HSV colors of a gradient. The
+    second color is the first with its hue shifted by the tempo's range.
+    '''
+    generator_inputs = attr_to_gen_input(tempo, valence, energy, acousticness)
+    hsv = generator_inputs[0]
+    range = generator_inputs[1]
+
+    c1 = hsv
+    c2 = [c1[0] + .2 * range, c1[1], c1[2]]
+    return (c1, c2)
+
+# ============
+#   RENDERING
+# ============
+
+def resolve_size(size=None) -> tuple[int, int]:
+    '''
+    Turn a size argument (None, an int or a (height, width) tuple) into a
+    (height, width) tuple. Raises ValueError for sizes out of range.
+    '''
+    if size is None:
+        return (HEIGHT, WIDTH)
+    if isinstance(size, int):
+        size = (size, size)
+    height, width = (int(x) for x in size)
+    if not (MIN_SIZE <= height <= MAX_SIZE and MIN_SIZE <= width <= MAX_SIZE):
+        raise ValueError(f"Image size must be between {MIN_SIZE} and {MAX_SIZE} pixels a side")
+    return (height, width)
+
+def render_array(shape, colors, interp, height, width):
+    '''
+    Render a ramp of colors to a (height, width, 3) uint8 array. Sizes with a
+    cached field are rendered exactly from it; bigger ones are colored from a
+    lookup table.
+    '''
+    field = fields.field_cache.get(shape, height, width)
+    lut_size = None if field is not None else engine.LUT_SIZE
+    return engine.render_ramp(shape, colors, height, width, interp, field, lut_size)
+
+def render_key(shape, c1, c2, interp="hsv", size=None, encoding=None) -> str:
+    '''
+    Get the content-addressed cache key of a render. Also used as its ETag.
+    '''
+    return ramp_key(shape, [c1, c2], interp, size, encoding)
+
+def ramp_key(shape, colors, interp="hsv", size=None, encoding=None) -> str:
+    '''
+    Get the cache key of a ramp render. Two-color ramps share their keys
+    with render_key.
+    '''
+    encoding = encoding or encode.DEFAULT_ENCODING
+    return cache.cache_key(shape, colors[0], colors[-1], resolve_size(size), encode.encoding_key(encoding), interp, stops=colors[1:-1])
+
+def render(shape, c1, c2, interp="hsv", size=None, encoding=None) -> io.BytesIO():
+    '''
+    Render a two-color gradient of the given shape, going through the render
+    cache so identical inputs are only ever rendered once. The encoding
+    (see encode.encoding) defaults to PNG.
+
+    Returns image data in BytesIO object.
+    '''
+    return render_ramp(shape, [c1, c2], interp, size, encoding)
+
+def render_ramp(shape, colors, interp="hsv", size=None, encoding=None) -> io.BytesIO():
+    '''
+    Render a gradient through any number of evenly spaced HSV colors, going
+    through the render cache like render.
+
+    Returns image data in BytesIO object.
+    '''
+    if len(colors) < 2:
+        raise ValueError("A ramp needs at least two colors")
+    encoding = encoding or encode.DEFAULT_ENCODING
+    height, width = resolve_size(size)
+    key = ramp_key(shape, colors, interp, (height, width), encoding)
+    data = cache.render_cache.get(key)
+    if data is None:
+        inst.count("render_cache", result="miss")
+        with inst.timer("render"):
+            a = render_array(shape, colors, interp, height, width)
+        with inst.timer("encode"):
+            data = encode.encode(a, encoding)
+        inst.count("bytes_encoded", len(data))
+        cache.render_cache.put(key, data)
+    else:
+        inst.count("render_cache", result="hit")
+    return io.BytesIO(data)
+
+def render_sizes(shape, c1, c2, sizes, interp="hsv") -> dict:
+    '''
+    Render the same gradient at several sizes, e.g. a cover, a thumbnail and
+    a print export. Each size is evaluated from the analytic field, so small
+    sizes stay exact instead of being resampled from a large one.
+
+    Returns a dict of size -> PNG data in BytesIO object.
+    '''
+    return {size: render(shape, c1, c2, interp, size) for size in sizes}
+
+# ==============
+#   URL TOKENS
+# ==============
+
+# colors are packed as millionths in unsigned ints, matching the precision
+# render cache keys are rounded to
+TOKEN_FORMAT = "<6I"
+TOKEN_SCALE = 10 ** cache.KEY_PRECISION
+
+def colors_to_token(c1, c2) -> str:
+    '''
+    Pack two HSV colors into a short URL-safe token.
+    '''
+    values = [round(x * TOKEN_SCALE) for x in list(c1) + list(c2)]
+    packed = struct.pack(TOKEN_FORMAT, *values)
+    return base64.urlsafe_b64encode(packed).decode("ascii").rstrip("=")
+
+def token_to_colors(token) -> tuple[list[float], list[float]]:
+    '''
+    Unpack a token made by colors_to_token. Raises ValueError if the token
+    isn't valid.
+    '''
+    try:
+        packed = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = [x / TOKEN_SCALE for x in struct.unpack(TOKEN_FORMAT, packed)]
+    except (ValueError, struct.error) as e:
+        raise ValueError(f"Invalid gradient token: {token}") from e
+    return (values[:3], values[3:])
+
 # ====================
 #   RGB Interpolation
 # ====================
 
-def gen_linear_horiz_grad_rgb_interp(c1, c2) -> io.BytesIO():
+def gen_linear_horiz_grad_rgb_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear horizontal gradient using HSV values.
+    Interpolation over the RGB colorspace.
 
     Returns PNG data in BytesIO object.
     '''
-    
-    # convert hsv floats to rgb ints
-    c1 = list(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(c1[0], c1[1], c1[2]))))
-    c2 = list(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(c2[0], c2[1], c2[2]))))
-
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-
-    # interpolate between the two colors
-    for i in range(WIDTH):
-        for j in range(HEIGHT):
-            a[i][j][0] = int((c2[0] - c1[0]) * (j / HEIGHT) + c1[0])
-            a[i][j][1] = int((c2[1] - c1[1]) * (j / HEIGHT) + c1[1])
-            a[i][j][2] = int((c2[2] - c1[2]) * (j / HEIGHT) + c1[2])
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
+    return render("horiz", c1, c2, interp="rgb", size=size)
 
-def gen_linear_vert_grad_rgb_interp(c1, c2) -> io.BytesIO():
+def gen_linear_vert_grad_rgb_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear vertical gradient using HSV values.
+    Interpolation over the RGB colorspace.
 
     Returns PNG data in BytesIO object.
     '''
+    return render("vert", c1, c2, interp="rgb", size=size)
 
-    # convert hsv floats to rgb ints
-    c1 = list(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(c1[0], c1[1], c1[2]))))
-    c2 = list(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(c2[0], c2[1], c2[2]))))
-
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-
-    # interpolate between the two colors
-    for i in range(WIDTH):
-        for j in range(HEIGHT):
-            a[i][j][0] = int((c2[0] - c1[0]) * (i / HEIGHT) + c1[0])
-            a[i][j][1] = int((c2[1] - c1[1]) * (i / HEIGHT) + c1[1])
-            a[i][j][2] = int((c2[2] - c1[2]) * (i / HEIGHT) + c1[2])
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
-
-def distance_toward_center(coord, center):
-    if coord > center:
-        return center * 2 - coord
-    return coord
-
-def gen_linear_diamond_grad_rgb_interp(c1, c2) -> io.BytesIO():
+def gen_linear_diamond_grad_rgb_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear diamond-shaped gradient using HSV values.
+    Interpolation over the RGB colorspace.
 
     Returns PNG data in BytesIO object.
     '''
-    
-    # convert hsv floats to rgb ints
-    c1 = list(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(c1[0], c1[1], c1[2]))))
-    c2 = list(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(c2[0], c2[1], c2[2]))))
+    return render("diamond", c1, c2, interp="rgb", size=size)
 
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-    
-    center = HEIGHT / 2
-
-    # interpolate between the two colors
-    for i in range(HEIGHT):
-        for j in range(WIDTH):
-            a[i][j][0] = int((c2[0] - c1[0]) * (((distance_toward_center(i, center) / center) + (distance_toward_center(j, center) / center))/2) + c1[0])
-            a[i][j][1] = int((c2[1] - c1[1]) * (((distance_toward_center(i, center) / center) + (distance_toward_center(j, center) / center))/2) + c1[1])
-            a[i][j][2] = int((c2[2] - c1[2]) * (((distance_toward_center(i, center) / center) + (distance_toward_center(j, center) / center))/2) + c1[2])
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
-
-def gen_linear_radial_grad_rgb_interp(c1, c2) -> io.BytesIO():
+def gen_linear_radial_grad_rgb_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear radial gradient using HSV values.
+    Interpolation over the RGB colorspace.
 
     Returns PNG data in BytesIO object.
     '''
-    
-    # convert hsv floats to rgb ints
-    c1 = list(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(c1[0], c1[1], c1[2]))))
-    c2 = list(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(c2[0], c2[1], c2[2]))))
+    return render("radial", c1, c2, interp="rgb", size=size)
 
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-    
-    center = HEIGHT / 2
-    radius = HEIGHT / 2
+def gen_linear_conic_grad_rgb_interp(c1, c2, size=None) -> io.BytesIO():
+    '''
+    Generate an image with a two-color linear conic gradient using HSV values.
+    Interpolation over the RGB colorspace.
 
-    # interpolate between the two colors
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            a[y][x][0], a[y][x][1], a[y][x][2] = radial_alg_rgb(c1, c2, radius, center, y, x)
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
-
-def radial_alg_rgb(c1, c2, radius, center, x, y):
-    dist_from_center = (sqrt((x - center) ** 2 + (y - center) ** 2))
-    if(dist_from_center > radius):
-        return (c1[0], c1[1], c1[2])
-    else:
-        r = int((c2[0] - c1[0]) * ((radius - dist_from_center) / radius) + c1[0])
-        g = int((c2[1] - c1[1]) * ((radius - dist_from_center) / radius) + c1[1])
-        b = int((c2[2] - c1[2]) * ((radius - dist_from_center) / radius) + c1[2])
-        return (r, g, b)
+    Returns PNG data in BytesIO object.
+    '''
+    return render("conic", c1, c2, interp="rgb", size=size)
 
 # ====================
 #   HSV INTERPOLATION
 # ====================
 
-def gen_linear_horiz_grad_hsv_interp(c1, c2) -> io.BytesIO():
+def gen_linear_horiz_grad_hsv_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear horizontal gradient using HSV values.
     Interpolation over the HSV colorspace.
 
     Returns PNG data in BytesIO object.
     '''
+    return render("horiz", c1, c2, interp="hsv", size=size)
 
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-
-    # interpolate between the two colors
-    for i in range(WIDTH):
-        for j in range(HEIGHT):
-            h = ((c2[0] - c1[0]) * (j / HEIGHT) + c1[0])
-            s = ((c2[1] - c1[1]) * (j / HEIGHT) + c1[1])
-            v = ((c2[2] - c1[2]) * (j / HEIGHT) + c1[2])
-
-            a[i][j][0], a[i][j][1], a[i][j][2] = tuple(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(h, s, v))))
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
-
-def gen_linear_vert_grad_hsv_interp(c1, c2) -> io.BytesIO():
+def gen_linear_vert_grad_hsv_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear vertical gradient using HSV values.
+    Interpolation over the HSV colorspace.
 
     Returns PNG data in BytesIO object.
     '''
+    return render("vert", c1, c2, interp="hsv", size=size)
 
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-
-    # interpolate between the two colors
-    for i in range(WIDTH):
-        for j in range(HEIGHT):
-            h = ((c2[0] - c1[0]) * (i / HEIGHT) + c1[0])
-            s = ((c2[1] - c1[1]) * (i / HEIGHT) + c1[1])
-            v = ((c2[2] - c1[2]) * (i / HEIGHT) + c1[2])
-
-            a[i][j][0], a[i][j][1], a[i][j][2] = tuple(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(h, s, v))))
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
-
-def gen_linear_diamond_grad_hsv_interp(c1, c2) -> io.BytesIO():
+def gen_linear_diamond_grad_hsv_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear diamond-shaped gradient using HSV values.
+    Interpolation over the HSV colorspace.
 
     Returns PNG data in BytesIO object.
     '''
+    return render("diamond", c1, c2, interp="hsv", size=size)
 
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-    
-    center = HEIGHT / 2
-
-    # interpolate between the two colors
-    for i in range(HEIGHT):
-        for j in range(WIDTH):
-            h = ((c2[0] - c1[0]) * (((distance_toward_center(i, center) / center) + (distance_toward_center(j, center) / center))/2) + c1[0])
-            s = ((c2[1] - c1[1]) * (((distance_toward_center(i, center) / center) + (distance_toward_center(j, center) / center))/2) + c1[1])
-            v = ((c2[2] - c1[2]) * (((distance_toward_center(i, center) / center) + (distance_toward_center(j, center) / center))/2) + c1[2])
-
-            a[i][j][0], a[i][j][1], a[i][j][2] = tuple(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(h, s, v))))
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
-
-def gen_linear_radial_grad_hsv_interp(c1, c2) -> io.BytesIO():
+def gen_linear_radial_grad_hsv_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear radial gradient using HSV values.
+    Interpolation over the HSV colorspace.
 
     Returns PNG data in BytesIO object.
     '''
+    return render("radial", c1, c2, interp="hsv", size=size)
 
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-    
-    center = HEIGHT / 2
-    radius = HEIGHT / 2
-
-    # interpolate between the two colors
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            h, s, v = radial_alg_hsv(c1, c2, radius, center, y, x)
-            a[y][x][0], a[y][x][1], a[y][x][2] = tuple(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(h, s, v))))
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
-
-def radial_alg_hsv(c1, c2, radius, center, x, y):
-    dist_from_center = (sqrt((x - center) ** 2 + (y - center) ** 2))
-    if(dist_from_center > radius):
-        return (c1[0], c1[1], c1[2])
-    else:
-        h = ((c2[0] - c1[0]) * ((radius - dist_from_center) / radius) + c1[0])
-        s = ((c2[1] - c1[1]) * ((radius - dist_from_center) / radius) + c1[1])
-        v = ((c2[2] - c1[2]) * ((radius - dist_from_center) / radius) + c1[2])
-        return (h, s, v)
-
-def gen_linear_conic_grad_hsv_interp(c1, c2) -> io.BytesIO():
+def gen_linear_conic_grad_hsv_interp(c1, c2, size=None) -> io.BytesIO():
     '''
     Generate an image with a two-color linear conic gradient using HSV values.
+    Interpolation over the HSV colorspace.
 
     Returns PNG data in BytesIO object.
     '''
-
-    # generate starting array
-    a = np.zeros((HEIGHT, WIDTH, RGB_VAL), dtype='uint8')
-
-    # interpolate between the two colors
-    for y in range(HEIGHT):
-        for x in range(WIDTH):
-            h, s, v = conic_alg_hsv(c1, c2, (x - 150), (y - 150))
-            a[y][x][0], a[y][x][1], a[y][x][2] = tuple(map(lambda x: int(x * 255), list(colorsys.hsv_to_rgb(h, s, v))))
-    
-    # make an image from the array and save it as a PNG
-    img = Image.fromarray(a)
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format="PNG")
-    return img_bytes
-
-def conic_alg_hsv(c1, c2, x, y):
-
-    degree = atan2(y, x)
-    degree += pi
-
-    percentage = degree / (2 * pi)
-
-    h = ((c2[0] - c1[0]) * percentage + c1[0])
-    s = ((c2[1] - c1[1]) * percentage + c1[1])
-    v = ((c2[2] - c1[2]) * percentage + c1[2])
-
-    return (h, s, v)
+    return render("conic", c1, c2, interp="hsv", size=size)
 
 # ============
 #   EXTERNAL
 # ============
 
-def gen_linear_horiz_grad_from_attr(tempo, valence, energy, acousticness) -> io.BytesIO():
+def gen_linear_horiz_grad_from_attr(tempo, valence, energy, acousticness, size=None) -> io.BytesIO():
     '''
     Generate a linear horizontal gradient image from song attributes.
 
@@ -346,18 +297,14 @@ def gen_linear_horiz_grad_from_attr(tempo, valence, energy, acousticness) -> io.
     valence: determines starting hue, value
     energy: determines saturation (additive)
     acousticness: determines saturation (subtractive)
+    size: image size, 300x300 by default
 
     Returns PNG data in BytesIO object.
     '''
-    generator_inputs = attr_to_gen_input(tempo, valence, energy, acousticness)
-    hsv = generator_inputs[0]
-    range = generator_inputs[1]
-    
-    c1 = hsv
-    c2 = [c1[0] + .2 * range, c1[1], c1[2]]
-    return gen_linear_horiz_grad_hsv_interp(c1, c2)
+    c1, c2 = attr_to_colors(tempo, valence, energy, acousticness)
+    return gen_linear_horiz_grad_hsv_interp(c1, c2, size)
 
-def gen_linear_vert_grad_from_attr(tempo, valence, energy, acousticness) -> io.BytesIO():
+def gen_linear_vert_grad_from_attr(tempo, valence, energy, acousticness, size=None) -> io.BytesIO():
     '''
     Generate a linear vertical gradient image from song attributes.
 
@@ -365,18 +312,14 @@ def gen_linear_vert_grad_from_attr(tempo, valence, energy, acousticness) -> io.B
     valence: determines starting hue, value
     energy: determines saturation (additive)
     acousticness: determines saturation (subtractive)
+    size: image size, 300x300 by default
 
     Returns PNG data in BytesIO object.
     '''
-    generator_inputs = attr_to_gen_input(tempo, valence, energy, acousticness)
-    hsv = generator_inputs[0]
-    range = generator_inputs[1]
-    
-    c1 = hsv
-    c2 = [c1[0] + .2 * range, c1[1], c1[2]]
-    return gen_linear_vert_grad_hsv_interp(c1, c2)
+    c1, c2 = attr_to_colors(tempo, valence, energy, acousticness)
+    return gen_linear_vert_grad_hsv_interp(c1, c2, size)
 
-def gen_linear_radial_grad_from_attr(tempo, valence, energy, acousticness) -> io.BytesIO():
+def gen_linear_radial_grad_from_attr(tempo, valence, energy, acousticness, size=None) -> io.BytesIO():
     '''
     Generate a linear radial gradient image from song attributes.
 
@@ -384,18 +327,14 @@ def gen_linear_radial_grad_from_attr(tempo, valence, energy, acousticness) -> io
     valence: determines starting hue, value
     energy: determines saturation (additive)
     acousticness: determines saturation (subtractive)
+    size: image size, 300x300 by default
 
     Returns PNG data in BytesIO object.
     '''
-    generator_inputs = attr_to_gen_input(tempo, valence, energy, acousticness)
-    hsv = generator_inputs[0]
-    range = generator_inputs[1]
-    
-    c1 = hsv
-    c2 = [c1[0] + .2 * range, c1[1], c1[2]]
-    return gen_linear_radial_grad_hsv_interp(c1, c2)
+    c1, c2 = attr_to_colors(tempo, valence, energy, acousticness)
+    return gen_linear_radial_grad_hsv_interp(c1, c2, size)
 
-def gen_linear_diamond_grad_from_attr(tempo, valence, energy, acousticness) -> io.BytesIO():
+def gen_linear_diamond_grad_from_attr(tempo, valence, energy, acousticness, size=None) -> io.BytesIO():
     '''
     Generate a linear diamond-shaped gradient image from song attributes.
 
@@ -403,18 +342,14 @@ def gen_linear_diamond_grad_from_attr(tempo, valence, energy, acousticness) -> i
     valence: determines starting hue, value
     energy: determines saturation (additive)
     acousticness: determines saturation (subtractive)
+    size: image size, 300x300 by default
 
     Returns PNG data in BytesIO object.
     '''
-    generator_inputs = attr_to_gen_input(tempo, valence, energy, acousticness)
-    hsv = generator_inputs[0]
-    range = generator_inputs[1]
-    
-    c1 = hsv
-    c2 = [c1[0] + .2 * range, c1[1], c1[2]]
-    return gen_linear_diamond_grad_hsv_interp(c1, c2)
+    c1, c2 = attr_to_colors(tempo, valence, energy, acousticness)
+    return gen_linear_diamond_grad_hsv_interp(c1, c2, size)
 
-def gen_linear_conic_grad_from_attr(tempo, valence, energy, acousticness) -> io.BytesIO():
+def gen_linear_conic_grad_from_attr(tempo, valence, energy, acousticness, size=None) -> io.BytesIO():
     '''
     Generate a linear diamond-shaped gradient image from song attributes.
 
@@ -422,16 +357,12 @@ def gen_linear_conic_grad_from_attr(tempo, valence, energy, acousticness) -> io.
     valence: determines starting hue, value
     energy: determines saturation (additive)
     acousticness: determines saturation (subtractive)
+    size: image size, 300x300 by default
 
     Returns PNG data in BytesIO object.
     '''
-    generator_inputs = attr_to_gen_input(tempo, valence, energy, acousticness)
-    hsv = generator_inputs[0]
-    range = generator_inputs[1]
-    
-    c1 = hsv
-    c2 = [c1[0] + .2 * range, c1[1], c1[2]]
-    return gen_linear_conic_grad_hsv_interp(c1, c2)
+    c1, c2 = attr_to_colors(tempo, valence, energy, acousticness)
+    return gen_linear_conic_grad_hsv_interp(c1, c2, size)
 
 # ============
 #   Testing
@@ -0,0 +1,190 @@
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from gradient_generator import cache, encode
+from gradient_generator import gradient_generator as gen
+from instrumentation import instrumentation as inst
+from os import getenv
+import multiprocessing
+import os
+import threading
+import time
+
+'''
+Render scheduler: runs gradient renders on a pool of worker processes so the
+CPU work doesn't hold the GIL of the Flask worker serving requests.
+
+Identical jobs already in flight share one future, and once more than
+RENDER_MAX_PENDING distinct jobs are queued, submitters wait (up to
+RENDER_QUEUE_TIMEOUT seconds) for room before giving up with RenderQueueFull.
+
+Workers are started with forkserver (spawn where that's missing) rather
+than forked from the app, whose other threads may hold locks a forked child
+would inherit held. If a worker dies (killed for memory, say), the pool is
+broken: the jobs it had fail, and the next submit starts a new pool.
+
+Configured with environment variables:
+    RENDER_WORKERS: number of worker processes (0 renders on threads instead)
+    RENDER_MAX_PENDING: most distinct jobs queued or running at once
+    RENDER_QUEUE_TIMEOUT: seconds to wait for room in a full queue
+'''
+DEFAULT_MAX_PENDING = 64
+DEFAULT_QUEUE_TIMEOUT = 5
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+class RenderQueueFull(Exception):
+    '''
+    Raised when the render queue stays full for longer than the timeout.
+    '''
+
+def render_bytes(shape, c1, c2, interp, height, width, encoding) -> bytes:
+    '''
+    Render and encode one gradient. Runs inside a worker process.
+    '''
+    a = gen.render_array(shape, [c1, c2], interp, height, width)
+    return encode.encode(a, encoding)
+
+def prime(shapes, size=None):
+    '''
+    Render and encode one throwaway gradient per shape, which builds their
+    cached fields and loads NumPy and Pillow. Runs inside a worker process.
+    '''
+    height, width = gen.resolve_size(size)
+    for shape in shapes:
+        render_bytes(shape, (0.0, 0.0, 0.0), (0.5, 1.0, 1.0), "hsv", height, width, encode.DEFAULT_ENCODING)
+
+class RenderScheduler:
+    '''
+    Dispatches render jobs to a process pool, coalescing identical in-flight
+    jobs and bounding how many can be queued.
+    '''
+
+    def __init__(self, workers=None, max_pending=DEFAULT_MAX_PENDING, queue_timeout=DEFAULT_QUEUE_TIMEOUT):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.coalesced = 0
+        self._inflight = {}
+        self._pool = None
+        self._room = threading.Condition()
+
+    def submit(self, shape, c1, c2, interp="hsv", size=None, encoding=None) -> Future:
+        '''
+        Schedule a render. Returns a future for the encoded image bytes (PNG
+        unless another encoding is given).
+        '''
+        encoding = encoding or encode.DEFAULT_ENCODING
+        height, width = gen.resolve_size(size)
+        key = gen.render_key(shape, c1, c2, interp, (height, width), encoding)
+        data = cache.render_cache.get(key)
+        if data is not None:
+            inst.count("render_cache", result="hit")
+            future = Future()
+            future.set_result(data)
+            return future
+
+        with self._room:
+            if key in self._inflight:
+                self.coalesced += 1
+                inst.count("render_jobs_coalesced")
+                return self._inflight[key]
+
+            if not self._room.wait_for(lambda: len(self._inflight) < self.max_pending, self.queue_timeout):
+                inst.count("render_queue_full")
+                raise RenderQueueFull(f"{len(self._inflight)} renders already queued")
+
+            # another thread may have queued this job while we waited
+            if key in self._inflight:
+                self.coalesced += 1
+                inst.count("render_jobs_coalesced")
+                return self._inflight[key]
+
+            inst.count("render_cache", result="miss")
+            inst.count("render_jobs")
+            pool = self._get_pool()
+            try:
+                job = pool.submit(render_bytes, shape, list(c1), list(c2), interp, height, width, encoding)
+            except BrokenProcessPool:
+                self._discard_pool(pool)
+                pool = self._get_pool()
+                job = pool.submit(render_bytes, shape, list(c1), list(c2), interp, height, width, encoding)
+            # resolved once the image is in the render cache, so anything
+            # woken by it finds the image there
+            future = Future()
+            self._inflight[key] = future
+        submitted = time.perf_counter()
+        job.add_done_callback(lambda f: self._finish(key, f, future, submitted, pool))
+        return future
+
+    def render_many(self, jobs) -> list[bytes]:
+        '''
+        Render a list of (shape, c1, c2[, interp[, size[, encoding]]]) jobs in
+        parallel. Returns their image bytes in the same order.
+        '''
+        futures = [self.submit(*job) for job in jobs]
+        return [future.result() for future in futures]
+
+    def warm_up(self, shapes, size=None):
+        '''
+        Start the pool and prime every worker for the given shapes, so the
+        first real renders don't pay for process startup or field builds.
+        '''
+        pool = self._get_pool()
+        # the pool starts a new worker for each job while none are idle, so
+        # these spread across all of them
+        jobs = [pool.submit(prime, list(shapes), size) for _ in range(max(self.workers, 1))]
+        for job in jobs:
+            job.result()
+
+    def pending(self) -> int:
+        with self._room:
+            return len(self._inflight)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _finish(self, key, job, future, submitted, pool):
+        inst.record("render_job", time.perf_counter() - submitted)
+        if not job.cancelled() and isinstance(job.exception(), BrokenProcessPool):
+            self._discard_pool(pool)
+        if not job.cancelled() and job.exception() is None:
+            inst.count("bytes_encoded", len(job.result()))
+            cache.render_cache.put(key, job.result())
+        with self._room:
+            self._inflight.pop(key, None)
+            self._room.notify()
+        if job.cancelled():
+            future.cancel()
+        elif job.exception() is not None:
+            future.set_exception(job.exception())
+        else:
+            future.set_result(job.result())
+
+    def _get_pool(self):
+        # started on first use so importing the app doesn't start workers
+        with self._room:
+            if self._pool is None:
+                if self.workers > 0:
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(START_METHOD))
+                else:
+                    self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="render")
+            return self._pool
+
+    def _discard_pool(self, pool):
+        '''
+        Drop a broken pool, so the next job starts a new one. Every job the
+        pool had fails with BrokenProcessPool, so only the first drops it.
+        '''
+        with self._room:
+            if self._pool is not pool:
+                return
+            self._pool = None
+        inst.count("render_pool_broken")
+        pool.shutdown(wait=False)
+
+render_scheduler = RenderScheduler(
+    workers=int(getenv("RENDER_WORKERS")) if getenv("RENDER_WORKERS") else None,
+    max_pending=int(getenv("RENDER_MAX_PENDING", DEFAULT_MAX_PENDING)),
+    queue_timeout=float(getenv("RENDER_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)),
+)
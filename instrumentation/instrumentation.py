@@ -0,0 +1,169 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getenv
+import cProfile
+import os
+import random
+import threading
+import time
+
+'''
+Lightweight metrics shared by the Flask app, playlist_data and
+gradient_generator.
+
+    count("spotify_requests", endpoint="playlist")   # bump a counter
+    with timer("render"):                             # time a stage
+        ...
+
+Counters and stage timers are process-wide and exposed in the Prometheus text
+format by render_prometheus(). Stages timed on a request's own thread are
+also collected per request, for the Server-Timing header.
+
+Configured with environment variables:
+    SERVER_TIMING: "1" to send a Server-Timing header on every response
+    PROFILE_SAMPLE_RATE: fraction of requests (0.0 to 1.0) to run under cProfile
+    PROFILE_DIR: where sampled profiles are written (default: ./profiles)
+'''
+PREFIX = "playlist_blender"
+
+SERVER_TIMING = getenv("SERVER_TIMING", "0") == "1"
+PROFILE_SAMPLE_RATE = float(getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = getenv("PROFILE_DIR", "profiles")
+
+_lock = threading.Lock()
+_counters = {}
+_timers = {}
+_request_timings = ContextVar("request_timings", default=None)
+
+# ============
+#   RECORDING
+# ============
+
+def metric_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def count(name, value=1, **labels):
+    '''
+    Add to a counter.
+    '''
+    key = metric_key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def get_count(name, **labels):
+    '''
+    Get a counter's current value.
+    '''
+    with _lock:
+        return _counters.get(metric_key(name, labels), 0)
+
+def record(stage, seconds):
+    '''
+    Record one timing of a stage.
+    '''
+    with _lock:
+        total = _timers.setdefault(stage, [0, 0.0])
+        total[0] += 1
+        total[1] += seconds
+
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timer(stage):
+    '''
+    Time the enclosed block as a stage.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+def reset():
+    '''
+    Clear every counter and timer.
+    '''
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+# ============
+#   REQUESTS
+# ============
+
+def start_request():
+    '''
+    Start collecting stage timings for the current request.
+    '''
+    _request_timings.set({})
+
+def request_timings():
+    '''
+    Get the stages timed so far in the current request, as stage -> seconds.
+    '''
+    return _request_timings.get() or {}
+
+def server_timing_header(timings):
+    '''
+    Format stage timings as a Server-Timing header value.
+    '''
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+def start_profile():
+    '''
+    Start a cProfile run for this request if it's picked by sampling.
+    Returns the profiler, or None.
+    '''
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+def finish_profile(profiler, name):
+    '''
+    Stop a profiler started by start_profile and write its stats to
+    PROFILE_DIR. Returns the file path.
+    '''
+    profiler.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_") or "root"
+    path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{safe_name}.prof")
+    profiler.dump_stats(path)
+    count("profiles_written")
+    return path
+
+# ==========
+#   EXPORT
+# ==========
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+def render_prometheus():
+    '''
+    Render every counter and timer in the Prometheus text exposition format.
+    '''
+    with _lock:
+        counters = dict(_counters)
+        timers = {stage: list(total) for stage, total in _timers.items()}
+
+    lines = []
+    for name in sorted({name for name, _ in counters}):
+        metric = f"{PREFIX}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"{metric}{format_labels(labels)} {value}")
+
+    if timers:
+        metric = f"{PREFIX}_stage_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for stage, (calls, seconds) in sorted(timers.items()):
+            lines.append(f'{metric}_count{{stage="{stage}"}} {calls}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {seconds:.6f}')
+    return "\n".join(lines) + "\n"
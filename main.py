@@ -1,12 +1,60 @@
-from flask import Flask, request, render_template
-import base64
-from gradient_generator import gradient_generator as gen
-from playlist_data import playlist_data as pd
+from flask import Flask, Response, abort, g, request, render_template, stream_with_context, url_for
+from concurrent.futures import as_completed
+from os import getenv
+import json
+import threading
+from gradient_generator import encode
+from playlist_blender import singleflight
+from instrumentation import instrumentation as inst
+
+# The renderer (NumPy, Pillow) and the Spotify client (spotipy) are imported
+# by the routes that need them, so a worker starts, and serves /, /about and
+# /metrics, without loading either. warm_up() loads them ahead of traffic.
 
 playlist_error = "Unable to retrieve playlist data."
+render_error = "Unable to render the gradients right now, please try again shortly."
+
+# the four gradients shown for every playlist, in display order
+gradient_shapes = ["vert", "diamond", "radial", "conic"]
+
+# gradient URLs are content-addressed, so their responses never change
+gradient_cache_control = "public, max-age=31536000, immutable"
+
+# playlists with similar blends shown under the results, and the size of
+# their gradient swatches
+similar_blends = 5
+similar_swatch_size = 64
 
 app = Flask(__name__)
 
+@app.before_request
+def start_instrumentation():
+    inst.start_request()
+    g.profiler = inst.start_profile()
+
+@app.after_request
+def finish_instrumentation(response):
+    inst.count("http_requests", endpoint=request.endpoint or "none", status=response.status_code)
+    if g.get("profiler") is not None:
+        inst.finish_profile(g.profiler, request.path)
+        g.profiler = None
+    timings = inst.request_timings()
+    if inst.SERVER_TIMING and timings:
+        response.headers["Server-Timing"] = inst.server_timing_header(timings)
+    return response
+
+@app.context_processor
+def negotiated_image_format():
+    # the format the page's streamed renders use; only worked out by
+    # templates that ask for it. Picked without checking what Pillow can
+    # write, so / doesn't load it: stream_image falls back to PNG for a
+    # format it can't encode.
+    return {"image_format": lambda: encode.negotiate(request.accept_mimetypes, formats=encode.NEGOTIABLE)}
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(inst.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
 @app.route("/", methods=["GET"])
 def index():
     return render_template("index.html")
@@ -17,6 +65,8 @@ def about():
 
 @app.route("/playlist_img", methods=["POST"])
 def display_image():
+    from gradient_generator import gradient_generator as gen
+
     if request.method == "POST":
 
         # ======================
@@ -24,35 +74,282 @@ def display_image():
         # ======================
 
         playlist_link = request.form.get("playlist_url")
-        metadata, tracks = pd.get_playlist_data(playlist_link)
-        if(metadata == None or tracks == None or tracks == []):
+        with inst.timer("fetch"):
+            metadata, attribute_data = fetch_playlist(playlist_link)
+        if(metadata == None or attribute_data == None or attribute_data.count == 0):
             return render_template("index.html", playlist_error=playlist_error)
 
         # =======================
-        # RETRIEVE ATTRIBUTE DATA
+        # AVERAGE ATTRIBUTE DATA
         # =======================
 
-        attribute_data = pd.get_attr_data(tracks)
-        average_data = pd.get_avg_attr_data(attribute_data)
+        average_data = attribute_data.averages()
 
         # ==================
         # GENERATE GRADIENTS
         # ==================
 
-        img1_data = gen.gen_linear_vert_grad_from_attr(average_data["tempo"], average_data["valence"], average_data["energy"], average_data["acousticness"]).getvalue()
-        img1_base64 = base64.b64encode(img1_data).decode("utf-8")
-
-        img2_data = gen.gen_linear_diamond_grad_from_attr(average_data["tempo"], average_data["valence"], average_data["energy"], average_data["acousticness"]).getvalue()
-        img2_base64 = base64.b64encode(img2_data).decode("utf-8")
-
-        img3_data = gen.gen_linear_radial_grad_from_attr(average_data["tempo"], average_data["valence"], average_data["energy"], average_data["acousticness"]).getvalue()
-        img3_base64 = base64.b64encode(img3_data).decode("utf-8")
-
-        img4_data = gen.gen_linear_conic_grad_from_attr(average_data["tempo"], average_data["valence"], average_data["energy"], average_data["acousticness"]).getvalue()
-        img4_base64 = base64.b64encode(img4_data).decode("utf-8")
+        # the images themselves are served (and cached) by gradient_image
+        c1, c2 = gen.attr_to_colors(average_data["tempo"], average_data["valence"], average_data["energy"], average_data["acousticness"])
+        format = encode.negotiate(request.accept_mimetypes)
+        images = [gradient_url(shape, c1, c2, format=format) for shape in gradient_shapes]
+        similar = record_blend(playlist_link, average_data, c1, c2, format)
 
         # ======
         # RENDER
         # ======
         
-        return render_template("index.html", metadata=metadata, attribute_data=average_data, img1=img1_base64, img2=img2_base64, img3=img3_base64, img4=img4_base64)
\ No newline at end of file
+        return render_template("index.html", metadata=metadata, attribute_data=average_data, images=images, similar=similar)
+
+@app.route("/gradient/<shape>/<token>", methods=["GET"], defaults={"format": None})
+@app.route("/gradient/<shape>/<token>.<format>", methods=["GET"])
+def gradient_image(shape, token, format):
+    '''
+    Serve one gradient image. The token encodes the gradient's colors, so a
+    URL always maps to the same image and can be cached forever.
+
+    The extension picks the format (png, webp, jpeg or avif); without one,
+    the format is negotiated from the Accept header. Optional arguments:
+        size: a square image of that many pixels a side
+        speed: encoder effort, "fast", "balanced" or "small"
+        quality: 1-100 for lossy output
+        palette: 1 to quantize to a 256-color palette first
+    '''
+    from gradient_generator import gradient_generator as gen
+    from gradient_generator.scheduler import RenderQueueFull
+
+    if shape not in gen.engine.SHAPES:
+        abort(404)
+    try:
+        c1, c2 = gen.token_to_colors(token)
+        size = gen.resolve_size(request.args.get("size", type=int))
+        encoding = encode.encoding(
+            format or encode.negotiate(request.accept_mimetypes),
+            speed=request.args.get("speed", "balanced"),
+            quality=request.args.get("quality", type=int),
+            palette=request.args.get("palette") == "1",
+        )
+    except ValueError:
+        abort(404)
+
+    etag = gen.render_key(shape, c1, c2, size=size, encoding=encoding)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        try:
+            with inst.timer("render_wait"):
+                data = singleflight.render_flight.do(etag, render_gradient, shape, c1, c2, size, encoding)
+        except RenderQueueFull:
+            return Response("Too many renders queued, try again shortly.", status=503, headers={"Retry-After": "1"})
+        response = Response(data, mimetype=encode.CONTENT_TYPES[encoding["format"]])
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = gradient_cache_control
+    if format is None:
+        response.vary.add("Accept")
+    return response
+
+@app.route("/animation/<shape>/<token>.<format>", methods=["GET"])
+def gradient_animation(shape, token, format):
+    '''
+    Serve a looping animation of one gradient, timed to a tempo. Like
+    gradient_image, a URL always maps to the same animation.
+
+    The extension picks the format (webp, png for APNG, or gif). Arguments:
+        tempo: beats per minute, required
+        animation: "rotate" or "pulse", by default rotate for conic
+            gradients and pulse for the rest
+        frames: frames per loop
+        beats: beats per loop
+        size: pixels a side, by default animate.DEFAULT_SIZE (480)
+        speed, quality: as for gradient_image
+
+    A first request renders the whole loop before responding. At the
+    default size with 60 frames that's about 0.4 s as lossy WebP, 0.3 s as
+    APNG and well under 0.1 s as GIF, whose files are by far the largest;
+    later requests are served from the render cache.
+    '''
+    from gradient_generator import animate, gradient_generator as gen
+
+    if shape not in gen.engine.SHAPES:
+        abort(404)
+    try:
+        c1, c2 = gen.token_to_colors(token)
+        tempo = request.args.get("tempo", type=float)
+        if tempo is None:
+            raise ValueError("A tempo is required")
+        options = {
+            "animation": request.args.get("animation") or animate.default_animation(shape),
+            "frames": request.args.get("frames", animate.DEFAULT_FRAMES, type=int),
+            "beats": request.args.get("beats", animate.DEFAULT_BEATS, type=int),
+            "size": gen.resolve_size(request.args.get("size", animate.DEFAULT_SIZE, type=int)),
+            "encoding": encode.animation_encoding(
+                format,
+                speed=request.args.get("speed", animate.DEFAULT_ENCODING["speed"]),
+                quality=request.args.get("quality", animate.DEFAULT_ENCODING["quality"] if format == "webp" else None, type=int),
+            ),
+        }
+        animate.check_options(options["animation"], options["frames"], options["beats"])
+        etag = animate.animation_key(shape, c1, c2, tempo, **options)
+    except ValueError:
+        abort(404)
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        with inst.timer("render_wait"):
+            data = singleflight.render_flight.do(etag, animate_gradient, shape, c1, c2, tempo, **options)
+        response = Response(data, mimetype=encode.CONTENT_TYPES[options["encoding"]["format"]])
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = gradient_cache_control
+    return response
+
+def fetch_playlist(playlist_link):
+    '''
+    Get the metadata and attribute sums of a playlist, or of any mix of
+    playlist, album, track and artist links, sharing one fetch between
+    concurrent requests for the same links.
+    '''
+    from playlist_data import resolver
+    try:
+        items = resolver.parse_links(playlist_link)
+    except ValueError:
+        return (None, None)
+    return singleflight.playlist_flight.do(resolver.link_key(items), resolver.get_items_attr_data, items)
+
+def record_blend(playlist_link, average_data, c1, c2, format="png"):
+    '''
+    Add a blend to the blend index and get the playlists whose blends are
+    nearest to it, each with a link (for playlists) and a swatch URL.
+    '''
+    from playlist_data import blends, resolver
+    try:
+        with inst.timer("blend_index"):
+            key = resolver.blend_key(resolver.parse_links(playlist_link))
+            blends.blend_index.add(key, average_data, c1, c2)
+            nearest = blends.blend_index.similar(key, similar_blends)
+    except Exception:
+        # the blend itself still works without the index
+        inst.count("blend_index_failed")
+        return []
+    similar = []
+    for blend in nearest:
+        key = blend["playlist_id"]
+        similar.append({
+            "playlist_id": key,
+            "url": None if ":" in key else f"https://open.spotify.com/playlist/{key}",
+            "image": gradient_url(gradient_shapes[-1], *blend["colors"], size=similar_swatch_size, format=format),
+        })
+    return similar
+
+def render_gradient(shape, c1, c2, size, encoding):
+    from gradient_generator.scheduler import render_scheduler
+    return render_scheduler.submit(shape, c1, c2, size=size, encoding=encoding).result()
+
+def animate_gradient(shape, c1, c2, tempo, **options):
+    from gradient_generator import animate
+    return animate.render_animation(shape, c1, c2, tempo, **options).getvalue()
+
+def gradient_url(shape, c1, c2, size=None, format="png"):
+    '''
+    Get the gradient_image URL for a gradient.
+    '''
+    from gradient_generator import gradient_generator as gen
+    args = {"shape": shape, "token": gen.colors_to_token(c1, c2), "format": format}
+    if size is not None:
+        args["size"] = size
+    return url_for("gradient_image", **args)
+
+@app.route("/playlist_img/stream", methods=["GET"])
+def stream_image():
+    '''
+    Progressive version of display_image, sent as server-sent events.
+
+    Sends a "metadata" event with the playlist metadata and averaged attributes
+    as soon as they're known, then a "gradient" event with each image's URL as
+    soon as it's rendered, then "done". Failures send an "error" event, with
+    a playlist_error if the playlist couldn't be read or a render_error if
+    its gradients couldn't be rendered.
+    '''
+    from gradient_generator import gradient_generator as gen
+    from gradient_generator.scheduler import render_scheduler
+    from playlist_data.aggregate import AttributeEstimate
+
+    playlist_link = request.args.get("playlist_url", "")
+    try:
+        encoding = encode.encoding(request.args.get("format", "png"))
+    except ValueError:
+        encoding = encode.DEFAULT_ENCODING
+
+    def events():
+        # open the stream straight away, before the slow Spotify fetch
+        yield ": fetching\n\n"
+
+        with inst.timer("fetch"):
+            metadata, attribute_data = fetch_playlist(playlist_link)
+        if(metadata == None or attribute_data == None or attribute_data.count == 0):
+            yield sse("error", {"playlist_error": playlist_error})
+            return
+
+        average_data = attribute_data.averages()
+        # colors go through the URL token so we render exactly what the
+        # URLs will ask for
+        c1, c2 = gen.attr_to_colors(average_data["tempo"], average_data["valence"], average_data["energy"], average_data["acousticness"])
+        c1, c2 = gen.token_to_colors(gen.colors_to_token(c1, c2))
+        event = {"metadata": metadata, "attribute_data": average_data}
+        if isinstance(attribute_data, AttributeEstimate):
+            # a long playlist, estimated from a sample of its tracks
+            event["estimate"] = attribute_data.report()
+        event["similar"] = record_blend(playlist_link, average_data, c1, c2, encoding["format"])
+        yield sse("metadata", event)
+
+        # render into the render cache so the browser's image requests are
+        # hits
+        try:
+            futures = {
+                render_scheduler.submit(shape, c1, c2, encoding=encoding): (index, gradient_url(shape, c1, c2, format=encoding["format"]))
+                for index, shape in enumerate(gradient_shapes, 1)
+            }
+            for future in as_completed(futures):
+                future.result()
+                index, url = futures[future]
+                yield sse("gradient", {"index": index, "url": url})
+        except Exception:
+            # a full render queue (RenderQueueFull) or a failed render; the
+            # page would otherwise wait on the missing images forever
+            inst.count("stream_render_failed")
+            yield sse("error", {"render_error": render_error})
+            return
+
+        yield sse("done", {})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(events()), mimetype="text/event-stream", headers=headers)
+
+def sse(event, data):
+    '''
+    Format one server-sent event with a JSON payload.
+    '''
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def warm_up():
+    '''
+    Get a worker ready for real traffic: import the renderer, prime the
+    render workers' field caches for the displayed shapes and fetch a Spotify
+    access token. Call it from a server hook (e.g. gunicorn's
+    post_worker_init), or set WARM_UP=1 to run it in the background when the
+    app is imported.
+    '''
+    from gradient_generator.scheduler import render_scheduler
+    from playlist_data import spotify
+
+    with inst.timer("warm_up"):
+        encode.available_formats()
+        render_scheduler.warm_up(gradient_shapes)
+        try:
+            spotify.warm_up()
+        except Exception:
+            # the first real request will try again
+            inst.count("warm_up_failed", step="spotify")
+
+if getenv("WARM_UP") == "1":
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
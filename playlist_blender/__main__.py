@@ -0,0 +1,111 @@
+import argparse
+import json
+import sys
+from gradient_generator import gradient_generator as gen, encode
+from gradient_generator.scheduler import render_scheduler
+from playlist_data import features, blends
+from playlist_blender import batch
+
+'''
+Command line entry point:
+
+    python -m playlist_blender batch playlists.txt --output covers/
+    python -m playlist_blender features import features.csv
+    python -m playlist_blender blends prerender --count 50
+'''
+
+def batch_command(args):
+    if args.input == "-":
+        playlist_ids = batch.read_playlist_ids(sys.stdin)
+    else:
+        with open(args.input) as f:
+            playlist_ids = batch.read_playlist_ids(f)
+    try:
+        batch.run(
+            playlist_ids,
+            args.output,
+            checkpoint_path=args.checkpoint,
+            shapes=args.shapes.split(","),
+            interp=args.interp,
+            size=args.size,
+            encoding=encode.encoding(args.format),
+            concurrency=args.concurrency,
+            progress_interval=args.progress,
+        )
+    finally:
+        render_scheduler.shutdown()
+
+def features_command(args):
+    if args.action == "stats":
+        print(json.dumps(features.feature_store.stats()))
+    elif args.action == "import":
+        with open(args.file, newline="") as f:
+            count = features.feature_store.import_csv(f)
+        print(f"imported {count} tracks", file=sys.stderr)
+    else:
+        with open(args.file, "w", newline="") as f:
+            count = features.feature_store.export_csv(f)
+        print(f"exported {count} tracks", file=sys.stderr)
+
+def blends_command(args):
+    if args.action == "stats":
+        print(json.dumps(blends.blend_index.stats()))
+        return
+    clusters = blends.blend_index.dense_clusters(args.count, args.cells)
+    if args.action == "clusters":
+        for cluster in clusters:
+            print(json.dumps(cluster))
+        return
+
+    # render into the render cache, which other processes share through
+    # RENDER_CACHE_DIR; colors go through a URL token, so these are exactly
+    # the renders gradient URLs ask for
+    encoding = encode.encoding(args.format)
+    try:
+        for cluster in clusters:
+            c1, c2 = gen.token_to_colors(gen.colors_to_token(*cluster["colors"]))
+            futures = [render_scheduler.submit(shape, c1, c2, size=args.size, encoding=encoding) for shape in args.shapes.split(",")]
+            for future in futures:
+                future.result()
+            print(json.dumps({"size": cluster["size"], "playlist_id": cluster["playlist_id"], "colors": cluster["colors"]}))
+    finally:
+        render_scheduler.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m playlist_blender", description="PlaylistBlender tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = commands.add_parser("batch", help="generate covers for a list of playlists")
+    batch_parser.add_argument("input", help="file of playlist IDs, URIs or URLs, one per line (- for stdin)")
+    batch_parser.add_argument("--output", required=True, help="output directory, or a .tar or .zip archive")
+    batch_parser.add_argument("--checkpoint", help="file recording finished playlists, for resuming")
+    batch_parser.add_argument("--shapes", default=",".join(batch.DEFAULT_SHAPES), help="comma-separated gradient shapes")
+    batch_parser.add_argument("--interp", choices=["hsv", "rgb"], default="hsv", help="interpolation colorspace")
+    batch_parser.add_argument("--size", type=int, help="image size in pixels a side (default 300)")
+    batch_parser.add_argument("--format", default="png", help="image format: png, webp or jpeg")
+    batch_parser.add_argument("--concurrency", type=int, default=batch.DEFAULT_CONCURRENCY, help="playlists fetched at once")
+    batch_parser.add_argument("--progress", type=float, default=batch.DEFAULT_PROGRESS_INTERVAL, help="seconds between progress lines")
+    batch_parser.set_defaults(func=batch_command)
+
+    features_parser = commands.add_parser("features", help="manage the feature store (FEATURE_STORE_URL)")
+    features_parser.add_argument("action", choices=["import", "export", "stats"])
+    features_parser.add_argument("file", nargs="?", help="CSV file with track_id plus one column per attribute")
+    features_parser.set_defaults(func=features_command)
+
+    blends_parser = commands.add_parser("blends", help="inspect the blend index (BLEND_INDEX_PATH)")
+    blends_parser.add_argument("action", choices=["stats", "clusters", "prerender"],
+                               help="clusters prints the densest clusters as JSON lines; prerender renders their gradients")
+    blends_parser.add_argument("--count", type=int, default=20, help="clusters to export")
+    blends_parser.add_argument("--cells", type=int, default=blends.DEFAULT_CLUSTER_CELLS, help="grid cells per attribute")
+    blends_parser.add_argument("--shapes", default=",".join(batch.DEFAULT_SHAPES), help="comma-separated gradient shapes to prerender")
+    blends_parser.add_argument("--size", type=int, help="image size in pixels a side (default 300)")
+    blends_parser.add_argument("--format", default="png", help="image format: png, webp or jpeg")
+    blends_parser.set_defaults(func=blends_command)
+
+    args = parser.parse_args(argv)
+    if args.command == "features" and args.action != "stats" and not args.file:
+        parser.error(f"features {args.action} needs a file")
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
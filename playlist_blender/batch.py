@@ -0,0 +1,314 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from gradient_generator import gradient_generator as gen, encode
+from gradient_generator.scheduler import render_scheduler
+from playlist_data import playlist_data as pd, blends
+from playlist_data.aggregate import AttributeEstimate
+from instrumentation import instrumentation as inst
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+'''
+Batch cover generation for whole catalogs of playlists.
+
+    python -m playlist_blender batch playlists.txt --output covers/
+    cat ids.txt | python -m playlist_blender batch - --output covers.zip --checkpoint covers.done
+
+Playlists are read one per line (IDs, URIs or URLs; blank lines and lines
+starting with # are skipped) and fetched a few at a time. Audio features go
+through the feature store (see playlist_data/features.py), so a track shared
+by many playlists is only requested from Spotify once, in this run or any
+earlier one sharing its FEATURE_STORE_URL. Renders go through the render
+scheduler.
+
+Each playlist's images are written as <playlist_id>/<shape>.<format> as soon
+as they're ready, and a JSON line describing it is printed to stdout. With
+--checkpoint, finished playlist IDs are appended to a file and skipped when
+the same command is run again, so a crashed run picks up where it stopped.
+Every blend is also added to the blend index (see playlist_data/blends.py).
+'''
+DEFAULT_SHAPES = ("vert", "diamond", "radial", "conic")
+DEFAULT_CONCURRENCY = 4
+DEFAULT_PROGRESS_INTERVAL = 10
+
+# playlists queued or running per batch worker; each finished one holds its
+# images until they're written, so this bounds a run's memory
+IN_FLIGHT_PER_WORKER = 2
+
+# =========
+#   INPUT
+# =========
+
+def read_playlist_ids(lines) -> list[str]:
+    '''
+    Parse playlist IDs from lines of IDs, URIs or URLs, dropping blank lines,
+    comments and duplicates.
+    '''
+    playlist_ids = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            playlist_ids.append(pd.parse_playlist_id(line))
+    return list(dict.fromkeys(playlist_ids))
+
+class Checkpoint:
+    '''
+    Append-only file of finished playlist IDs.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self) -> set[str]:
+        try:
+            with open(self.path) as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def mark(self, playlist_ids):
+        with open(self.path, "a") as f:
+            for playlist_id in playlist_ids:
+                f.write(f"{playlist_id}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+# ===========
+#   WRITERS
+# ===========
+
+# Writers are only used from the main thread. `durable` says whether a file
+# is safe on disk as soon as write() returns; zip files aren't readable until
+# their central directory is written on close, so their playlists are only
+# checkpointed then.
+
+class DirectoryWriter:
+    durable = True
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        pass
+
+class TarWriter:
+    durable = True
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+        self._tar = tarfile.open(fileobj=self._file, mode="w")
+
+    def write(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self._tar.addfile(info, io.BytesIO(data))
+        # a tar cut short still reads up to its last whole member
+        self._file.flush()
+
+    def close(self):
+        self._tar.close()
+        self._file.close()
+
+class ZipWriter:
+    durable = False
+
+    def __init__(self, path):
+        # images are already compressed
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED)
+
+    def write(self, name, data):
+        self._zip.writestr(name, data)
+
+    def close(self):
+        self._zip.close()
+
+ARCHIVES = {".tar": TarWriter, ".zip": ZipWriter}
+
+def open_writer(output):
+    '''
+    Open a writer for a directory, .tar or .zip path. An archive that
+    already exists (from an earlier, possibly crashed run) is never appended
+    to; the next free part name is used instead, e.g. covers.1.zip.
+    '''
+    base, ext = os.path.splitext(output)
+    if ext not in ARCHIVES:
+        return DirectoryWriter(output)
+    path = output
+    part = 0
+    while os.path.exists(path):
+        part += 1
+        path = f"{base}.{part}{ext}"
+    return ARCHIVES[ext](path)
+
+# =========
+#   BATCH
+# =========
+
+def blend_playlist(playlist_id, shapes, interp, size, encoding):
+    '''
+    Fetch one playlist and render its covers. Runs on a batch worker thread.
+
+    Returns a result dict; "images" maps shape -> image bytes, and "error"
+    is set instead when the playlist couldn't be read.
+    '''
+    metadata, attribute_data = pd.get_playlist_attr_data(playlist_id)
+    if metadata is None or attribute_data is None or attribute_data.count == 0:
+        return {"playlist_id": playlist_id, "error": "Unable to retrieve playlist data."}
+
+    average_data = attribute_data.averages()
+    c1, c2 = gen.attr_to_colors(average_data["tempo"], average_data["valence"], average_data["energy"], average_data["acousticness"])
+    futures = {shape: render_scheduler.submit(shape, c1, c2, interp, size, encoding) for shape in shapes}
+    blends.blend_index.add(playlist_id, average_data, c1, c2)
+    result = {
+        "playlist_id": playlist_id,
+        "metadata": metadata,
+        "attribute_data": average_data,
+        "tracks": attribute_data.count,
+        "images": {shape: future.result() for shape, future in futures.items()},
+    }
+    if isinstance(attribute_data, AttributeEstimate):
+        result["estimate"] = attribute_data.report()
+    return result
+
+class Throughput:
+    '''
+    Running totals for a batch, reported as rates.
+    '''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.playlists = 0
+        self.failed = 0
+        self.tracks = 0
+        self.images = 0
+        self.bytes = 0
+        # the counters are process-wide, so only count this batch's share
+        self._feature_hits = inst.get_count("feature_cache", result="hit")
+        self._feature_misses = inst.get_count("feature_cache", result="miss")
+
+    def add(self, result):
+        if "error" in result:
+            self.failed += 1
+            return
+        self.playlists += 1
+        self.tracks += result["tracks"]
+        self.images += len(result["images"])
+        self.bytes += sum(len(data) for data in result["images"].values())
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        hits = inst.get_count("feature_cache", result="hit") - self._feature_hits
+        misses = inst.get_count("feature_cache", result="miss") - self._feature_misses
+        return {
+            "playlists": self.playlists,
+            "failed": self.failed,
+            "tracks": self.tracks,
+            "images": self.images,
+            "bytes": self.bytes,
+            "elapsed_s": round(elapsed, 3),
+            "playlists_per_s": round(self.playlists / elapsed, 3) if elapsed else 0.0,
+            "tracks_per_s": round(self.tracks / elapsed, 1) if elapsed else 0.0,
+            "images_per_s": round(self.images / elapsed, 3) if elapsed else 0.0,
+            "feature_cache_hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        }
+
+def blend_playlists(pool, playlist_ids, window, shapes, interp, size, encoding):
+    '''
+    Run blend_playlist over playlist IDs on a pool, yielding results as they
+    finish, with at most `window` playlists submitted and not yet yielded.
+    A playlist that raises yields an error result instead.
+    '''
+    remaining = iter(playlist_ids)
+    pending = {}
+    while True:
+        for playlist_id in remaining:
+            pending[pool.submit(blend_playlist, playlist_id, shapes, interp, size, encoding)] = playlist_id
+            if len(pending) >= window:
+                break
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            playlist_id = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                inst.count("batch_playlists_failed")
+                result = {"playlist_id": playlist_id, "error": f"{type(e).__name__}: {e}"}
+            yield result
+
+def run(playlist_ids, output, checkpoint_path=None, shapes=DEFAULT_SHAPES, interp="hsv", size=None,
+        encoding=None, concurrency=DEFAULT_CONCURRENCY, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+        stdout=sys.stdout, stderr=sys.stderr) -> dict:
+    '''
+    Generate covers for every playlist not already in the checkpoint.
+    Playlists are submitted a few at a time as earlier ones are written, and
+    one that fails for any reason gets an error line rather than stopping
+    the run.
+
+    Returns the throughput summary, which is also printed to stderr.
+    '''
+    encoding = encoding or encode.DEFAULT_ENCODING
+    checkpoint = Checkpoint(checkpoint_path) if checkpoint_path else None
+    done = checkpoint.load() if checkpoint else set()
+    todo = [playlist_id for playlist_id in playlist_ids if playlist_id not in done]
+    if done:
+        print(f"skipping {len(playlist_ids) - len(todo)} playlists already in {checkpoint_path}", file=stderr)
+
+    throughput = Throughput()
+    if not todo:
+        return throughput.summary()
+    writer = open_writer(output)
+    unsaved = []
+    last_progress = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    try:
+        for result in blend_playlists(pool, todo, concurrency * IN_FLIGHT_PER_WORKER, shapes, interp, size, encoding):
+            throughput.add(result)
+
+            line = {"playlist_id": result["playlist_id"]}
+            if "error" in result:
+                line["error"] = result["error"]
+            else:
+                line["files"] = []
+                for shape, data in result["images"].items():
+                    name = f"{result['playlist_id']}/{shape}.{encoding['format']}"
+                    writer.write(name, data)
+                    line["files"].append(name)
+                line.update(tracks=result["tracks"], metadata=result["metadata"], attribute_data=result["attribute_data"])
+                if "estimate" in result:
+                    line["estimate"] = result["estimate"]
+                if checkpoint and writer.durable:
+                    checkpoint.mark([result["playlist_id"]])
+                elif checkpoint:
+                    unsaved.append(result["playlist_id"])
+            print(json.dumps(line), file=stdout, flush=True)
+
+            if time.perf_counter() - last_progress >= progress_interval:
+                last_progress = time.perf_counter()
+                print(f"{throughput.playlists + throughput.failed}/{len(todo)} playlists, {throughput.summary()['playlists_per_s']}/s", file=stderr)
+    finally:
+        # don't start playlists nobody will write out
+        pool.shutdown(cancel_futures=True)
+        writer.close()
+        if checkpoint and unsaved:
+            checkpoint.mark(unsaved)
+
+    summary = throughput.summary()
+    print(json.dumps(summary), file=stderr)
+    return summary
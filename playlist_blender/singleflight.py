@@ -0,0 +1,171 @@
+from concurrent.futures import Future
+from instrumentation import instrumentation as inst
+from os import getenv
+import sqlite3
+import threading
+import time
+import uuid
+
+'''
+Single-flight request coalescing.
+
+When a playlist goes viral, many requests for it arrive at once. Wrapping the
+playlist fetch and the render in SingleFlight.do makes concurrent calls with
+the same key wait on one in-flight call and share its result.
+
+Within a process, callers share the leader's result directly. Across worker
+processes, a shared lock backend makes one process run the call while the
+others wait for it to finish, then run theirs, which find the leader's result
+in the shared caches (PLAYLIST_CACHE_URL, RENDER_CACHE_DIR) instead of doing
+the work again. A lock is held for at most SINGLE_FLIGHT_LEASE seconds, so a
+crashed leader only delays the others.
+
+Configured with environment variables:
+    SINGLE_FLIGHT_URL: lock backend shared between processes, sqlite:///path.db
+        or redis://host:port/0 (unset coalesces within each process only)
+    SINGLE_FLIGHT_LEASE: seconds a cross-process lock is held at most
+'''
+DEFAULT_LEASE = 30
+DEFAULT_POLL_INTERVAL = 0.05
+
+# =========
+#   LOCKS
+# =========
+
+class SQLiteLocks:
+    '''
+    Expiring locks in a SQLite file shared by every worker on the host.
+    '''
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=DEFAULT_LEASE)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, token TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def acquire(self, key, token, lease) -> bool:
+        now = time.time()
+        with self._lock, self._conn:
+            # takes the lock if nobody holds it, or if its holder's lease ran out
+            cursor = self._conn.execute(
+                "INSERT INTO locks (key, token, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET token = excluded.token, expires = excluded.expires WHERE locks.expires < ?",
+                (key, token, now + lease, now),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key, token):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM locks WHERE key = ? AND token = ?", (key, token))
+
+class RedisLocks:
+    '''
+    Expiring locks on a Redis-compatible server.
+    '''
+
+    # delete the key only if it still holds our token
+    RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+
+    def acquire(self, key, token, lease) -> bool:
+        return bool(self._client.set(key, token, nx=True, px=int(lease * 1000)))
+
+    def release(self, key, token):
+        self._client.eval(self.RELEASE, 1, key, token)
+
+def locks_from_url(url):
+    '''
+    Build a lock backend from a sqlite:/// or redis:// URL, or None for
+    in-process coalescing only.
+    '''
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteLocks(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisLocks(url=url)
+    raise ValueError(f"Unsupported single-flight URL: {url}")
+
+# =================
+#   SINGLE FLIGHT
+# =================
+
+class SingleFlight:
+    '''
+    Runs at most one call per key at a time, sharing its result (or
+    exception) with every caller that arrives while it's in flight.
+    '''
+
+    def __init__(self, name, locks=None, lease=DEFAULT_LEASE, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.name = name
+        self.locks = locks
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        '''
+        Call fn(*args, **kwargs), unless a call with the same key is already
+        in flight, in which case wait for it and return its result.
+        '''
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            inst.count("single_flight", flight=self.name, result="coalesced")
+            return future.result()
+
+        try:
+            future.set_result(self._run(key, fn, args, kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+    def _run(self, key, fn, args, kwargs):
+        if self.locks is None:
+            inst.count("single_flight", flight=self.name, result="leader")
+            return fn(*args, **kwargs)
+
+        lock_key = f"singleflight:{self.name}:{key}"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lease
+        acquired = self.locks.acquire(lock_key, token, self.lease)
+        inst.count("single_flight", flight=self.name, result="leader" if acquired else "waited")
+        # another process has it; once it's done, our call finds its result
+        # in the shared caches
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            acquired = self.locks.acquire(lock_key, token, self.lease)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if acquired:
+                self.locks.release(lock_key, token)
+
+def configure(url=None, lease=DEFAULT_LEASE, locks=None):
+    '''
+    Replace the process-wide flights, either from a URL or with an
+    already-built lock backend.
+    '''
+    global playlist_flight, render_flight
+    locks = locks or locks_from_url(url)
+    playlist_flight = SingleFlight("playlist", locks=locks, lease=lease)
+    render_flight = SingleFlight("render", locks=locks, lease=lease)
+    return playlist_flight, render_flight
+
+playlist_flight, render_flight = configure(getenv("SINGLE_FLIGHT_URL"), float(getenv("SINGLE_FLIGHT_LEASE", DEFAULT_LEASE)))
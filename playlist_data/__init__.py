@@ -1,15 +1,10 @@
-from dotenv import load_dotenv
-from os import getenv
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
+'''
+Spotify playlist data. The Spotify client is created on first use (see
+spotify.py); `sp` is kept as a lazy alias for it.
+'''
 
-# ====
-# AUTH
-# ====
-
-load_dotenv()
-client_id = getenv("SPOTIPY_CLIENT_ID")
-client_secret = getenv("SPOTIPY_CLIENT_SECRET")
-
-auth_manager = SpotifyClientCredentials()
-sp = spotipy.Spotify(auth_manager=auth_manager)
\ No newline at end of file
+def __getattr__(name):
+    if name == "sp":
+        from playlist_data import spotify
+        return spotify.get_client()
+    raise AttributeError(f"module 'playlist_data' has no attribute '{name}'")
@@ -0,0 +1,297 @@
+import numpy as np
+
+'''
+Columnar table of track audio features.
+
+Only the four ATTRIBUTES are kept, as float32 columns next to an array of
+track IDs, so a track costs a few tens of bytes however many fields Spotify
+sent for it. Each batch is turned into columns as it arrives, and the
+batches are joined into single columns on first read; averages, weighted
+averages, percentiles and outlier trimming are then NumPy reductions over
+whole columns.
+'''
+ATTRIBUTES = ("valence", "energy", "acousticness", "tempo")
+
+class AttributeTable:
+    '''
+    Float32 column per attribute plus a track ID per row.
+    '''
+
+    def __init__(self, attributes=ATTRIBUTES):
+        self.attributes = attributes
+        self._track_ids = np.empty(0, dtype=np.bytes_)
+        self._columns = {name: np.empty(0, dtype=np.float32) for name in attributes}
+        self._pending = []
+
+    @classmethod
+    def from_features(cls, features, track_ids=None, attributes=ATTRIBUTES):
+        '''
+        Build a table from a list of audio feature dicts, with optional
+        matching track IDs.
+        '''
+        table = cls(attributes)
+        if track_ids is None:
+            track_ids = [""] * len(features)
+        table.add_many(zip(track_ids, features))
+        return table
+
+    def add_many(self, tracks):
+        '''
+        Append an iterable of (track_id, features) pairs, e.g. one API batch.
+        The batch is turned into columns straight away, so the feature dicts
+        can be freed while later batches arrive.
+        '''
+        tracks = list(tracks)
+        if tracks:
+            ids = np.array([track_id.encode() for track_id, _ in tracks], dtype=np.bytes_)
+            columns = {
+                name: np.fromiter((features[name] for _, features in tracks), dtype=np.float32, count=len(tracks))
+                for name in self.attributes
+            }
+            self._pending.append((ids, columns))
+        return self
+
+    def _consolidate(self):
+        if not self._pending:
+            return
+        batches = self._pending
+        self._pending = []
+        self._track_ids = np.concatenate([self._track_ids] + [ids for ids, _ in batches])
+        for name in self.attributes:
+            self._columns[name] = np.concatenate([self._columns[name]] + [columns[name] for _, columns in batches])
+
+    @property
+    def track_ids(self):
+        self._consolidate()
+        return self._track_ids
+
+    @property
+    def columns(self):
+        self._consolidate()
+        return self._columns
+
+    @property
+    def count(self):
+        return len(self.track_ids)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.track_ids.nbytes + sum(column.nbytes for column in self.columns.values())
+
+    def select(self, mask):
+        '''
+        Get a new table holding the rows where a boolean mask is set.
+        '''
+        table = AttributeTable(self.attributes)
+        table._track_ids = self.track_ids[mask]
+        table._columns = {name: column[mask] for name, column in self.columns.items()}
+        return table
+
+    def rows(self, track_ids):
+        '''
+        Get a new table holding the rows of the given track IDs.
+        '''
+        return self.select(np.isin(self.track_ids, np.array([i.encode() for i in track_ids], dtype=np.bytes_)))
+
+    def means(self, weights=None):
+        '''
+        Get the (optionally weighted) mean of each attribute, summed in
+        float64.
+        '''
+        if weights is None:
+            return {name: float(np.sum(column, dtype=np.float64) / len(column)) for name, column in self.columns.items()}
+        weights = np.asarray(weights, dtype=np.float64)
+        total = weights.sum()
+        return {name: float(np.dot(column.astype(np.float64), weights) / total) for name, column in self.columns.items()}
+
+    def averages(self, weights=None):
+        '''
+        Get the average of each attribute, rounded to 3 decimals.
+        '''
+        return {name: round(mean, 3) for name, mean in self.means(weights).items()}
+
+    def variances(self):
+        '''
+        Get the sample variance of each attribute.
+        '''
+        if self.count < 2:
+            return dict.fromkeys(self.attributes, 0.0)
+        return {name: float(np.var(column, dtype=np.float64, ddof=1)) for name, column in self.columns.items()}
+
+    def percentiles(self, q):
+        '''
+        Get the q-th percentile(s) of each attribute.
+        '''
+        return {name: np.percentile(column, q) for name, column in self.columns.items()}
+
+    def trimmed(self, proportion=0.05):
+        '''
+        Get a new table without outliers: tracks in the lowest or highest
+        `proportion` of any attribute are dropped.
+        '''
+        keep = np.ones(self.count, dtype=bool)
+        for column in self.columns.values():
+            low, high = np.quantile(column, [proportion, 1 - proportion])
+            keep &= (column >= low) & (column <= high)
+        return self.select(keep)
+
+    def stats(self):
+        '''
+        Get mean, standard deviation, min and max for each attribute.
+        '''
+        means = self.means()
+        variances = self.variances()
+        return {
+            name: {
+                "mean": means[name],
+                "stdev": float(np.sqrt(variances[name])),
+                "min": float(column.min()),
+                "max": float(column.max()),
+            }
+            for name, column in self.columns.items()
+        }
+
+class AttributeSums:
+    '''
+    Count, sum and sum of squares of each attribute. Tracks can be taken out
+    as well as added, so a playlist's aggregate can follow its edits without
+    revisiting every track. Serializes to a small dict for the playlist cache.
+    '''
+
+    def __init__(self, count=0, sums=None, squares=None, attributes=ATTRIBUTES):
+        self.attributes = attributes
+        self.count = count
+        self.sums = sums or dict.fromkeys(attributes, 0.0)
+        self.squares = squares or dict.fromkeys(attributes, 0.0)
+
+    @classmethod
+    def from_table(cls, table):
+        return cls(attributes=table.attributes).add(table)
+
+    def add(self, table, sign=1):
+        '''
+        Add every track in an AttributeTable (or take them out, with sign=-1).
+        '''
+        self.count += sign * table.count
+        for name, column in table.columns.items():
+            column = column.astype(np.float64)
+            self.sums[name] += sign * float(column.sum())
+            self.squares[name] += sign * float(np.dot(column, column))
+        return self
+
+    def remove(self, table):
+        return self.add(table, sign=-1)
+
+    def combine(self, other):
+        '''
+        Add the tracks counted by another AttributeSums.
+        '''
+        self.count += other.count
+        for name in self.attributes:
+            self.sums[name] += other.sums[name]
+            self.squares[name] += other.squares[name]
+        return self
+
+    def means(self):
+        return {name: self.sums[name] / self.count for name in self.attributes}
+
+    def averages(self):
+        '''
+        Get the average of each attribute, rounded to 3 decimals.
+        '''
+        return {name: round(mean, 3) for name, mean in self.means().items()}
+
+    def variances(self):
+        '''
+        Get the sample variance of each attribute.
+        '''
+        if self.count < 2:
+            return dict.fromkeys(self.attributes, 0.0)
+        return {
+            name: max(0.0, (self.squares[name] - self.sums[name] ** 2 / self.count) / (self.count - 1))
+            for name in self.attributes
+        }
+
+    def to_dict(self):
+        return {"count": self.count, "sums": self.sums, "squares": self.squares}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["count"], dict(data["sums"]), dict(data["squares"]))
+
+class AttributeEstimate:
+    '''
+    Attribute means estimated from a sample of a playlist's tracks, each with
+    the half-width of its confidence interval. Has the same count and
+    averages() as AttributeSums, count being the number of tracks sampled.
+    converged is False if sampling stopped at its cap before the estimate
+    was as tight as asked for, in which case the colors may be off.
+    Serializes to a small dict for the playlist cache, like AttributeSums.
+    '''
+
+    def __init__(self, means, errors, count, total, confidence, converged=True, attributes=ATTRIBUTES):
+        self.attributes = attributes
+        self.means = means
+        self.errors = errors
+        self.count = count
+        self.total = total
+        self.confidence = confidence
+        self.converged = converged
+
+    def averages(self):
+        '''
+        Get the estimated average of each attribute, rounded to 3 decimals.
+        '''
+        return {name: round(self.means[name], 3) for name in self.attributes}
+
+    def report(self):
+        '''
+        Describe the sample and the error bound it achieved.
+        '''
+        return {
+            "sampled": self.count,
+            "total": self.total,
+            "confidence": self.confidence,
+            "converged": self.converged,
+            "errors": {name: round(self.errors[name], 4) for name in self.attributes},
+        }
+
+    def to_dict(self):
+        return {
+            "means": self.means,
+            "errors": self.errors,
+            "count": self.count,
+            "total": self.total,
+            "confidence": self.confidence,
+            "converged": self.converged,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(dict(data["means"]), dict(data["errors"]), data["count"], data["total"], data["confidence"], data["converged"])
+
+def ratio_estimate(sums, sizes, population, z):
+    '''
+    Estimate means from whole clusters of tracks (e.g. pages) drawn without
+    replacement from `population` clusters. sums is an (m, k) array of each
+    cluster's sums of k quantities, sizes the (m,) track counts.
+
+    Returns (means, errors), (k,) arrays of the ratio estimates and the
+    half-widths of their confidence intervals at z standard errors. The
+    variance treats the clusters as a simple random sample, which overstates
+    it for stratified ones.
+    '''
+    sums = np.asarray(sums, dtype=np.float64)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    m = len(sizes)
+    means = sums.sum(axis=0) / sizes.sum()
+    if m >= population:
+        return means, np.zeros_like(means)
+    if m < 2:
+        return means, np.full_like(means, np.inf)
+    residuals = sums - np.outer(sizes, means)
+    variance = (1 - m / population) * (residuals ** 2).sum(axis=0) / (m - 1) / (m * sizes.mean() ** 2)
+    return means, z * np.sqrt(variance)
@@ -0,0 +1,443 @@
+from playlist_data.aggregate import ATTRIBUTES
+from heapq import heappop, heappush, heappushpop
+from os import getenv
+import numpy as np
+import sqlite3
+import struct
+import threading
+import time
+
+'''
+Persistent index of every blend worked out so far: a playlist's averaged
+ATTRIBUTES and the two HSV colors they resolved to, keyed by playlist ID
+(or resolver.link_key for other links).
+
+Rows live in a SQLite table. In memory, each process keeps them as arrays
+plus a KD-tree over the attributes normalized by NORMALIZE, which answers
+k-nearest-neighbor queries ("playlists with a similar blend") in well under
+a millisecond at millions of blends. New blends go into a small buffer that
+queries scan directly. Once the buffer outgrows a fraction of the tree, a
+new tree is built on a background thread, which takes seconds at millions
+of blends, and swapped in when it's done; until then queries keep using the
+old tree and the buffer. Blends other processes add are picked up every
+SYNC_INTERVAL seconds.
+
+dense_clusters() buckets the normalized attributes into a grid and reports
+the fullest cells, each with the stored colors of the blend nearest its
+center, so their gradients can be rendered before anyone asks for them.
+
+Configured with environment variables:
+    BLEND_INDEX_PATH: SQLite file for the index (default: in memory only)
+'''
+DEFAULT_PATH = ":memory:"
+
+# ATTRIBUTES, and then c1 and c2, as little-endian float32
+ATTRIBUTES_FORMAT = "<" + "f" * len(ATTRIBUTES)
+COLORS_FORMAT = "<6f"
+
+# attribute -> (low, high) mapped to 0.0 to 1.0, so a step in tempo counts
+# about as much as the same change in color from any other attribute
+NORMALIZE = {
+    "valence": (0.0, 1.0),
+    "energy": (0.0, 1.0),
+    "acousticness": (0.0, 1.0),
+    "tempo": (60.0, 200.0),
+}
+LOWS = np.array([NORMALIZE[name][0] for name in ATTRIBUTES], dtype=np.float32)
+SPANS = np.array([NORMALIZE[name][1] - NORMALIZE[name][0] for name in ATTRIBUTES], dtype=np.float32)
+
+# points per KD-tree leaf, scanned with one vectorized distance computation;
+# bigger leaves mean fewer nodes visited in Python
+LEAF_SIZE = 128
+# the tree is rebuilt once the buffer holds this many blends, or
+# 1/REBUILD_FRACTION of the tree, whichever is more
+REBUILD_MIN = 1024
+REBUILD_FRACTION = 32
+SYNC_INTERVAL = 5
+DEFAULT_CLUSTER_CELLS = 8
+
+def normalize(attributes) -> np.ndarray:
+    '''
+    Turn an attribute dict into a point in the index's normalized space.
+    '''
+    return (np.array([attributes[name] for name in ATTRIBUTES], dtype=np.float32) - LOWS) / SPANS
+
+# ==========
+#   KDTREE
+# ==========
+
+class KDTree:
+    '''
+    Static KD-tree over an (n, d) array of points, split at the median of
+    the widest dimension down to LEAF_SIZE-point leaves. Each node keeps its
+    points' bounding box, and each leaf's points are contiguous, so a leaf
+    is scanned as one array.
+    '''
+
+    def __init__(self, points, rows, leaf_size=LEAF_SIZE):
+        order = np.arange(len(points))
+        # per node: the range of points under it, its bounding box and its
+        # children, which are -1 for leaves
+        self.starts, self.stops, self.lows, self.highs, self.lefts, self.rights = [], [], [], [], [], []
+        stack = [self._node(points, order, 0, len(points))]
+        while stack:
+            node = stack.pop()
+            start, stop = self.starts[node], self.stops[node]
+            if stop - start <= leaf_size:
+                continue
+            indices = order[start:stop]
+            block = points[indices]
+            dim = int(np.argmax(np.subtract(self.highs[node], self.lows[node])))
+            middle = (stop - start) // 2
+            order[start:stop] = indices[np.argpartition(block[:, dim], middle)]
+            self.lefts[node] = self._node(points, order, start, start + middle)
+            self.rights[node] = self._node(points, order, start + middle, stop)
+            stack.extend((self.lefts[node], self.rights[node]))
+        self.points = np.ascontiguousarray(points[order])
+        self.rows = rows[order]
+
+    def _node(self, points, order, start, stop):
+        block = points[order[start:stop]]
+        empty = [0.0] * points.shape[1]
+        self.starts.append(start)
+        self.stops.append(stop)
+        self.lows.append(block.min(axis=0).tolist() if len(block) else empty)
+        self.highs.append(block.max(axis=0).tolist() if len(block) else empty)
+        self.lefts.append(-1)
+        self.rights.append(-1)
+        return len(self.starts) - 1
+
+    def __len__(self):
+        return len(self.points)
+
+    def box_distance(self, coords, node) -> float:
+        '''
+        Squared distance from a point to a node's bounding box.
+        '''
+        distance = 0.0
+        for x, low, high in zip(coords, self.lows[node], self.highs[node]):
+            if x < low:
+                distance += (low - x) * (low - x)
+            elif x > high:
+                distance += (x - high) * (x - high)
+        return distance
+
+    def query(self, point, k, alive, heap=None) -> list:
+        '''
+        Find the k nearest points whose rows are set in the alive mask.
+        Returns a heap of (-squared distance, row) tuples, which can be
+        passed back in as heap to keep searching from.
+        '''
+        heap = [] if heap is None else heap
+        if not len(self.points):
+            return heap
+        coords = point.tolist()
+        # nodes nearest first, so the search stops at the first node farther
+        # than the kth nearest point found
+        nodes = [(0.0, 0)]
+        while nodes:
+            bound, node = heappop(nodes)
+            if len(heap) == k and bound >= -heap[0][0]:
+                break
+            if self.lefts[node] < 0:
+                start, stop = self.starts[node], self.stops[node]
+                scan(self.points[start:stop], self.rows[start:stop], point, k, alive, heap)
+                continue
+            for child in (self.lefts[node], self.rights[node]):
+                distance = self.box_distance(coords, child)
+                if len(heap) < k or distance < -heap[0][0]:
+                    heappush(nodes, (distance, child))
+        return heap
+
+def scan(points, rows, point, k, alive, heap):
+    '''
+    Brute-force points into a (-squared distance, row) heap of at most k.
+    '''
+    deltas = points - point
+    distances = np.einsum("ij,ij->i", deltas, deltas)
+    keep = alive[rows]
+    if len(heap) == k:
+        keep &= distances < -heap[0][0]
+    candidates = np.flatnonzero(keep)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+    for i in candidates.tolist():
+        item = (-float(distances[i]), int(rows[i]))
+        if len(heap) < k:
+            heappush(heap, item)
+        elif item > heap[0]:
+            heappushpop(heap, item)
+
+# =========
+#   INDEX
+# =========
+
+class BlendIndex:
+    '''
+    Blends in a SQLite file, with an in-memory KD-tree over them for nearest
+    neighbor queries. Safe to share between threads.
+    '''
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            # replaced rows get a new rowid, so rows past the last one read
+            # are exactly what changed since
+            self._conn.execute("CREATE TABLE IF NOT EXISTS blends (playlist_id TEXT PRIMARY KEY, attributes BLOB NOT NULL, colors BLOB NOT NULL)")
+        # row -> playlist ID and playlist ID -> row; the arrays below hold
+        # one row per blend read, and grow by doubling
+        self._keys = []
+        self._rows = {}
+        self._attributes = np.empty((0, len(ATTRIBUTES)), dtype=np.float32)
+        self._points = np.empty((0, len(ATTRIBUTES)), dtype=np.float32)
+        self._colors = np.empty((0, 6), dtype=np.float32)
+        self._alive = np.empty(0, dtype=bool)
+        self._allocate(0)
+        self._tree = KDTree(self._points[:0], np.empty(0, dtype=np.intp))
+        self._rebuilder = None
+        self._last_rowid = 0
+        self._synced_at = 0.0
+
+    def add(self, playlist_id, attributes, c1, c2):
+        '''
+        Store a playlist's averaged attributes and the colors they resolved
+        to, replacing any earlier blend of it.
+        '''
+        self.add_many([(playlist_id, attributes, c1, c2)])
+
+    def add_many(self, blends):
+        '''
+        Store (playlist_id, attributes, c1, c2) tuples.
+        '''
+        rows = [
+            (playlist_id, struct.pack(ATTRIBUTES_FORMAT, *(attributes[name] for name in ATTRIBUTES)), struct.pack(COLORS_FORMAT, *c1, *c2))
+            for playlist_id, attributes, c1, c2 in blends
+        ]
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO blends (playlist_id, attributes, colors) VALUES (?, ?, ?)", rows)
+            self._sync()
+
+    def get(self, playlist_id):
+        '''
+        Get a stored blend as a dict, or None.
+        '''
+        with self._lock:
+            self._sync(lazy=True)
+            row = self._rows.get(playlist_id)
+            return None if row is None else self._blend(row)
+
+    def nearest(self, attributes, k=10, exclude=()) -> list[dict]:
+        '''
+        Get the k blends nearest to a set of averaged attributes, nearest
+        first, leaving out the playlist IDs in exclude. Each has a
+        "distance" in the normalized space.
+        '''
+        point = normalize(attributes)
+        with self._lock:
+            self._sync(lazy=True)
+            excluded = [self._rows[key] for key in exclude if key in self._rows]
+            alive = self._alive
+            if excluded:
+                alive = alive.copy()
+                alive[excluded] = False
+            heap = self._tree.query(point, k, alive)
+            # blends added since the tree was built
+            buffered = np.arange(len(self._tree), len(self._keys))
+            scan(self._points[buffered], buffered, point, k, alive, heap)
+            return [dict(self._blend(row), distance=float(np.sqrt(-distance))) for distance, row in sorted(heap, reverse=True)]
+
+    def similar(self, playlist_id, k=10) -> list[dict]:
+        '''
+        Get the k blends nearest to a stored playlist's, not counting itself.
+        '''
+        blend = self.get(playlist_id)
+        if blend is None:
+            return []
+        return self.nearest(blend["attributes"], k, exclude=(playlist_id,))
+
+    def dense_clusters(self, count=20, cells=DEFAULT_CLUSTER_CELLS) -> list[dict]:
+        '''
+        Bucket every blend into a grid of `cells` cells a side over the
+        normalized space, and describe the `count` fullest cells, fullest
+        first: how many blends fall in it, their mean attributes, and the
+        blend nearest that mean, whose colors stand in for the cell.
+        '''
+        with self._lock:
+            self._sync(lazy=True)
+            rows = np.flatnonzero(self._alive)
+            if not len(rows):
+                return []
+            buckets = np.clip((self._points[rows] * cells).astype(np.intp), 0, cells - 1)
+            codes = np.ravel_multi_index(buckets.T, (cells,) * len(ATTRIBUTES))
+            order = np.argsort(codes, kind="stable")
+            codes, rows = codes[order], rows[order]
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+            sizes = np.diff(np.r_[starts, len(codes)])
+
+            clusters = []
+            for i in np.argsort(-sizes, kind="stable")[:count].tolist():
+                members = rows[starts[i]:starts[i] + sizes[i]]
+                center = self._attributes[members].mean(axis=0)
+                deltas = self._points[members] - (center - LOWS) / SPANS
+                medoid = members[np.argmin(np.einsum("ij,ij->i", deltas, deltas))]
+                clusters.append({
+                    "size": int(sizes[i]),
+                    "center": dict(zip(ATTRIBUTES, center.tolist())),
+                    **self._blend(medoid),
+                })
+            return clusters
+
+    def __len__(self):
+        with self._lock:
+            self._sync(lazy=True)
+            return int(self._alive.sum())
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._sync(lazy=True)
+            return {
+                "blends": int(self._alive.sum()),
+                "tree": len(self._tree),
+                "buffered": len(self._keys) - len(self._tree),
+            }
+
+    def _blend(self, row):
+        colors = self._colors[row].tolist()
+        return {
+            "playlist_id": self._keys[row],
+            "attributes": dict(zip(ATTRIBUTES, self._attributes[row].tolist())),
+            "colors": (colors[:3], colors[3:]),
+        }
+
+    def _sync(self, lazy=False):
+        '''
+        Read rows added since the last sync into memory. Lazy syncs only
+        happen every SYNC_INTERVAL seconds.
+        '''
+        now = time.monotonic()
+        if lazy and now - self._synced_at < SYNC_INTERVAL:
+            return
+        self._synced_at = now
+        rows = self._conn.execute(
+            "SELECT rowid, playlist_id, attributes, colors FROM blends WHERE rowid > ? ORDER BY rowid", (self._last_rowid,)
+        ).fetchall()
+        if not rows:
+            return
+        self._last_rowid = rows[-1][0]
+        keys = [key for _, key, _, _ in rows]
+        attributes = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.float32).reshape(len(rows), len(ATTRIBUTES))
+        colors = np.frombuffer(b"".join(row[3] for row in rows), dtype=np.float32).reshape(len(rows), 6)
+
+        # a playlist blended again replaces its old row
+        replaced = [self._rows[key] for key in keys if key in self._rows]
+        first = len(self._keys)
+        end = first + len(rows)
+        if end > len(self._alive):
+            self._allocate(end)
+        self._keys.extend(keys)
+        self._rows.update((key, first + i) for i, key in enumerate(keys))
+        self._attributes[first:end] = attributes
+        self._points[first:end] = (attributes - LOWS) / SPANS
+        self._colors[first:end] = colors
+        self._alive[first:end] = True
+        self._alive[replaced] = False
+        # a key repeated within this read keeps only its last row
+        self._alive[first:end][[self._rows[key] != first + i for i, key in enumerate(keys)]] = False
+        self._start_rebuild()
+
+    def _start_rebuild(self):
+        '''
+        Start rebuilding the tree in the background if the buffer has
+        outgrown it and no rebuild is running.
+        '''
+        if self._rebuilder is None and len(self._keys) - len(self._tree) > max(REBUILD_MIN, len(self._tree) // REBUILD_FRACTION):
+            # rows below count are never written again, apart from being
+            # marked dead, and the arrays are replaced rather than resized,
+            # so the rebuild can read them without the lock
+            count = len(self._keys)
+            self._rebuilder = threading.Thread(
+                target=self._rebuild,
+                args=(count, self._keys[:count], self._alive[:count].copy(), self._attributes, self._points, self._colors),
+                name="blend-index-rebuild",
+                daemon=True,
+            )
+            self._rebuilder.start()
+
+    def _rebuild(self, count, keys, alive, attributes, points, colors):
+        '''
+        Drop replaced rows and build a tree over the first `count` rows, as
+        they were when the rebuild started, without holding the lock. Then
+        swap the result in, with the rows read since appended as the buffer.
+        '''
+        try:
+            live = np.flatnonzero(alive)
+            start = len(live)
+            # room for the rows read while this runs, most likely
+            size = capacity(start + max(REBUILD_MIN, start // REBUILD_FRACTION))
+            def compact(array):
+                compacted = np.zeros((size,) + array.shape[1:], dtype=array.dtype)
+                compacted[:start] = array[live]
+                return compacted
+            compacted = [compact(attributes), compact(points), compact(colors), np.zeros(size, dtype=bool)]
+            keys = [keys[row] for row in live.tolist()]
+            rows = {key: row for row, key in enumerate(keys)}
+            tree = KDTree(compacted[1][:start], np.arange(start))
+
+            with self._lock:
+                current = [self._attributes, self._points, self._colors, self._alive]
+                added = self._keys[count:]
+                # rows replaced during the rebuild are dead by now
+                compacted[3][:start] = self._alive[live]
+                self._attributes, self._points, self._colors, self._alive = compacted
+                self._keys = keys
+                end = start + len(added)
+                if end > size:
+                    self._allocate(end)
+                for array, old in zip((self._attributes, self._points, self._colors, self._alive), current):
+                    array[start:end] = old[count:count + len(added)]
+                rows.update((key, start + i) for i, key in enumerate(added))
+                self._keys.extend(added)
+                self._rows = rows
+                self._tree = tree
+        finally:
+            with self._lock:
+                self._rebuilder = None
+                # blends added during a long rebuild may call for another
+                self._start_rebuild()
+
+    def _allocate(self, size):
+        '''
+        Make room for at least `size` rows, keeping the rows already read.
+        '''
+        size = capacity(size)
+        count = len(self._keys)
+        def grow(array):
+            grown = np.zeros((size,) + array.shape[1:], dtype=array.dtype)
+            grown[:count] = array[:count]
+            return grown
+        self._attributes = grow(self._attributes)
+        self._points = grow(self._points)
+        self._colors = grow(self._colors)
+        self._alive = grow(self._alive)
+
+def capacity(size) -> int:
+    '''
+    Get the rows to allocate for `size`: the next power of two, and at
+    least REBUILD_MIN.
+    '''
+    return max(REBUILD_MIN, 1 << max(0, size - 1).bit_length())
+
+blend_index = BlendIndex(getenv("BLEND_INDEX_PATH", DEFAULT_PATH))
+
+def configure(path=DEFAULT_PATH):
+    '''
+    Replace the process-wide blend index.
+    '''
+    global blend_index
+    blend_index = BlendIndex(path)
+    return blend_index
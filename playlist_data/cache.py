@@ -0,0 +1,208 @@
+from collections import OrderedDict
+from os import getenv
+import json
+import sqlite3
+import threading
+import time
+
+'''
+Caching layer for Spotify playlist listings. (Track audio features live in
+the feature store, see features.py.)
+
+Playlist listings are cached for PLAYLIST_CACHE_TTL seconds; once that runs
+out, the entry is revalidated against the playlist's current snapshot_id
+instead of being paged again. Entries also carry the running attribute sums
+of the playlist, so an edited playlist can be re-blended from a diff (see
+playlist_data.reblend); every page is fetched again at least every
+PLAYLIST_FULL_REFRESH seconds. Sampled playlists keep their estimate
+instead, valid until the snapshot_id changes.
+
+The storage backend is picked from PLAYLIST_CACHE_URL:
+    memory://            in-process LRU (default)
+    sqlite:///path.db    SQLite file shared by every worker on the host
+    redis://host:port/0  any Redis-compatible server
+'''
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 100000
+
+# ============
+#   BACKENDS
+# ============
+
+class MemoryBackend:
+    '''
+    In-process LRU key-value store.
+    '''
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+        return found
+
+    def set_many(self, mapping):
+        with self._lock:
+            for key, value in mapping.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class SQLiteBackend:
+    '''
+    Key-value store in a SQLite file, values stored as JSON.
+    '''
+
+    # stay under SQLite's limit on variables per statement
+    CHUNK = 500
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.CHUNK):
+                chunk = keys[i:i + self.CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT key, value FROM kv WHERE key IN ({placeholders})", chunk)
+                for key, value in rows:
+                    found[key] = json.loads(value)
+        return found
+
+    def set_many(self, mapping):
+        rows = [(key, json.dumps(value)) for key, value in mapping.items()]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", rows)
+
+class RedisBackend:
+    '''
+    Key-value store on a Redis-compatible server, values stored as JSON.
+    '''
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._client.mget(keys)
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping):
+        if mapping:
+            self._client.mset({key: json.dumps(value) for key, value in mapping.items()})
+
+def backend_from_url(url):
+    '''
+    Build a backend from a memory://, sqlite:/// or redis:// URL.
+    '''
+    if not url or url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url=url)
+    raise ValueError(f"Unsupported playlist cache URL: {url}")
+
+# ===========
+#   CACHE
+# ===========
+
+class PlaylistCache:
+    '''
+    Playlist listings on top of a key-value backend.
+    '''
+
+    def __init__(self, backend, ttl=DEFAULT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get_playlist(self, playlist_id):
+        '''
+        Get the cached entry for a playlist, or None. The entry is a dict with
+        "snapshot_id", "metadata", "uris", "sums", "fetched_at" and
+        "verified_at", plus "estimate" for a sampled playlist, whose "uris"
+        and "sums" are None.
+        '''
+        entry = self.backend.get_many([f"playlist:{playlist_id}"]).get(f"playlist:{playlist_id}")
+        if entry is None or "uris" not in entry:
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry["fetched_at"] < self.ttl
+
+    def put_playlist(self, playlist_id, snapshot_id, metadata, uris, sums=None, verified_at=None):
+        '''
+        Cache a playlist listing. uris holds one entry per playlist position
+        (None where the track is gone), sums the playlist's AttributeSums as
+        a dict, and verified_at when every page was last fetched.
+        '''
+        now = time.time()
+        entry = {
+            "snapshot_id": snapshot_id,
+            "metadata": metadata,
+            "uris": uris,
+            "sums": sums,
+            "fetched_at": now,
+            "verified_at": verified_at or now,
+        }
+        self.backend.set_many({f"playlist:{playlist_id}": entry})
+        return entry
+
+    def put_estimate(self, playlist_id, snapshot_id, metadata, estimate):
+        '''
+        Cache a sampled playlist's AttributeEstimate, as a dict, in place of
+        its listing.
+        '''
+        now = time.time()
+        entry = {
+            "snapshot_id": snapshot_id,
+            "metadata": metadata,
+            "uris": None,
+            "sums": None,
+            "estimate": estimate,
+            "fetched_at": now,
+            "verified_at": now,
+        }
+        self.backend.set_many({f"playlist:{playlist_id}": entry})
+        return entry
+
+    def touch_playlist(self, playlist_id, entry):
+        '''
+        Mark a revalidated entry as fresh again.
+        '''
+        entry["fetched_at"] = time.time()
+        self.backend.set_many({f"playlist:{playlist_id}": entry})
+
+playlist_cache = PlaylistCache(
+    backend_from_url(getenv("PLAYLIST_CACHE_URL")),
+    ttl=float(getenv("PLAYLIST_CACHE_TTL", DEFAULT_TTL)),
+)
+
+def configure(url=None, ttl=DEFAULT_TTL, backend=None):
+    '''
+    Replace the process-wide playlist cache, either from a URL or with an
+    already-built backend.
+    '''
+    global playlist_cache
+    playlist_cache = PlaylistCache(backend or backend_from_url(url), ttl=ttl)
+    return playlist_cache
@@ -0,0 +1,271 @@
+from playlist_data.aggregate import ATTRIBUTES
+from os import getenv
+import csv
+import sqlite3
+import struct
+import threading
+
+'''
+Persistent store of track audio features, shared by every playlist.
+
+Audio features never change for a given track, so once a track has been seen
+in any playlist it never has to be requested from Spotify again. Features are
+kept keyed by track ID, each row holding the ATTRIBUTES packed as float32 (16
+bytes a track), which keeps a catalog of millions of tracks to a few tens of
+megabytes.
+
+The storage backend is picked from FEATURE_STORE_URL, as for the playlist
+cache (see cache.py):
+    memory://            in-process dict (default)
+    sqlite:///path.db    SQLite file, kept between runs
+    redis://host:port/0  any Redis-compatible server, shared between hosts
+'''
+DEFAULT_URL = "memory://"
+
+# ATTRIBUTES as little-endian float32, in order
+ROW_FORMAT = "<" + "f" * len(ATTRIBUTES)
+
+def track_id(uri):
+    '''
+    Get the bare track ID from a track URI or ID.
+    '''
+    return uri.rsplit(":", 1)[-1]
+
+def pack(features) -> bytes:
+    return struct.pack(ROW_FORMAT, *(features[name] for name in ATTRIBUTES))
+
+def unpack(data) -> dict:
+    return dict(zip(ATTRIBUTES, struct.unpack(ROW_FORMAT, data)))
+
+def float32_str(x) -> str:
+    '''
+    Format a float32 value with the fewest digits that read back as the same
+    float32, e.g. 0.35 rather than 0.3499999940395355.
+    '''
+    for digits in range(6, 9):
+        text = f"{x:.{digits}g}"
+        if struct.unpack("<f", struct.pack("<f", float(text)))[0] == x:
+            return text
+    return f"{x:.9g}"
+
+# ============
+#   BACKENDS
+# ============
+
+# Backends map track IDs to packed rows. pages() yields lists of (track_id,
+# row) tuples, holding any lock only while a page is read.
+
+class MemoryBackend:
+    '''
+    In-process dict of packed rows. Never evicts: a row is smaller than the
+    request it saves.
+    '''
+
+    PAGE = 500
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        with self._lock:
+            return {key: self._rows[key] for key in keys if key in self._rows}
+
+    def set_many(self, mapping):
+        with self._lock:
+            self._rows.update(mapping)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def pages(self):
+        with self._lock:
+            keys = list(self._rows)
+        for i in range(0, len(keys), self.PAGE):
+            yield list(self.get_many(keys[i:i + self.PAGE]).items())
+
+class SQLiteBackend:
+    '''
+    Packed rows in a SQLite table.
+    '''
+
+    # stay under SQLite's limit on variables per statement
+    CHUNK = 500
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS features (track_id TEXT PRIMARY KEY, attributes BLOB NOT NULL) WITHOUT ROWID")
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.CHUNK):
+                chunk = keys[i:i + self.CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT track_id, attributes FROM features WHERE track_id IN ({placeholders})", chunk)
+                found.update(rows)
+        return found
+
+    def set_many(self, mapping):
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO features (track_id, attributes) VALUES (?, ?)", mapping.items())
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM features").fetchone()[0]
+
+    def pages(self):
+        last = ""
+        while True:
+            # page through by key so the lock is only held a page at a time
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT track_id, attributes FROM features WHERE track_id > ? ORDER BY track_id LIMIT ?",
+                    (last, self.CHUNK),
+                ).fetchall()
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+
+class RedisBackend:
+    '''
+    Packed rows in one hash on a Redis-compatible server.
+    '''
+
+    KEY = "features"
+    PAGE = 500
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._client = client
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._client.hmget(self.KEY, keys)
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, mapping):
+        if mapping:
+            self._client.hset(self.KEY, mapping=mapping)
+
+    def __len__(self):
+        return self._client.hlen(self.KEY)
+
+    def pages(self):
+        page = []
+        for key, value in self._client.hscan_iter(self.KEY, count=self.PAGE):
+            page.append((key.decode(), value))
+            if len(page) >= self.PAGE:
+                yield page
+                page = []
+        if page:
+            yield page
+
+def backend_from_url(url):
+    '''
+    Build a backend from a memory://, sqlite:/// or redis:// URL.
+    '''
+    if not url or url.startswith("memory://"):
+        return MemoryBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBackend(url=url)
+    raise ValueError(f"Unsupported feature store URL: {url}")
+
+# =========
+#   STORE
+# =========
+
+class FeatureStore:
+    '''
+    Track audio features on top of a backend, with hit-rate stats. Safe to
+    share between threads.
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, uris) -> dict:
+        '''
+        Get stored features for track URIs as a dict of uri -> features.
+        Tracks that aren't stored are left out.
+        '''
+        ids = {track_id(uri): uri for uri in uris}
+        found = {ids[key]: unpack(data) for key, data in self.backend.get_many(ids).items()}
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+        return found
+
+    def put_many(self, features):
+        '''
+        Store a dict of uri -> features.
+        '''
+        self.backend.set_many({track_id(uri): pack(value) for uri, value in features.items()})
+
+    def __len__(self):
+        return len(self.backend)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "tracks": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def import_csv(self, f, batch_size=10000) -> int:
+        '''
+        Bulk load features from a CSV file with a track_id column plus one
+        column per attribute. Returns the number of tracks loaded.
+        '''
+        count = 0
+        batch = {}
+        for row in csv.DictReader(f):
+            batch[row["track_id"]] = {name: float(row[name]) for name in ATTRIBUTES}
+            if len(batch) >= batch_size:
+                self.put_many(batch)
+                count += len(batch)
+                batch = {}
+        self.put_many(batch)
+        return count + len(batch)
+
+    def export_csv(self, f) -> int:
+        '''
+        Write every stored track to a CSV file in the format import_csv
+        reads. Returns the number of tracks written.
+        '''
+        writer = csv.writer(f)
+        writer.writerow(("track_id",) + ATTRIBUTES)
+        count = 0
+        for rows in self.backend.pages():
+            for key, data in rows:
+                writer.writerow((key,) + tuple(float32_str(x) for x in struct.unpack(ROW_FORMAT, data)))
+            count += len(rows)
+        return count
+
+feature_store = FeatureStore(backend_from_url(getenv("FEATURE_STORE_URL", DEFAULT_URL)))
+
+def configure(url=DEFAULT_URL, backend=None):
+    '''
+    Replace the process-wide feature store, either from a URL or with an
+    already-built backend.
+    '''
+    global feature_store
+    feature_store = FeatureStore(backend or backend_from_url(url))
+    return feature_store
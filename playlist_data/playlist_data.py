@@ -1,33 +1,371 @@
-from playlist_data import sp
+from playlist_data import spotify, cache, features
+from playlist_data.aggregate import ATTRIBUTES, AttributeEstimate, AttributeSums, AttributeTable, ratio_estimate
+from collections import Counter
+from instrumentation import instrumentation as inst
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from os import getenv
+from statistics import NormalDist
+from urllib.parse import urlparse
+import math
+import numpy as np
+import random
+import time
+
+# ===========
+# CONCURRENCY
+# ===========
+
+# Page and audio-feature requests run on one bounded pool. Every worker goes
+# through the same spotipy client, and so the same HTTP connection pool.
+PAGE_SIZE = 100
+MAX_WORKERS = int(getenv("SPOTIFY_MAX_WORKERS", 8))
+MAX_RETRIES = int(getenv("SPOTIFY_MAX_RETRIES", 3))
+DEFAULT_RETRY_AFTER = 1
+
+# retried with exponential backoff (capped at BACKOFF_MAX seconds) and full
+# jitter; 429s wait for Retry-After instead, plus a little jitter
+RETRY_STATUSES = (500, 502, 503, 504)
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 8
+
+# longest a cached playlist is re-blended from diffs before every page is
+# fetched again
+FULL_REFRESH = float(getenv("PLAYLIST_FULL_REFRESH", 24 * 60 * 60))
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="spotify")
+
+# a spotipy client to use instead of the shared one, e.g. in benchmarks
+sp = None
+
+def client():
+    return sp if sp is not None else spotify.get_client()
+
+def call(fn, *args, **kwargs):
+    '''
+    Call a spotipy method, retrying rate limits, server errors and dropped
+    connections. 429 responses are retried once the Retry-After header says
+    so; the rest back off exponentially. Jitter keeps threads that failed
+    together from all retrying together. A rejected token is replaced and
+    retried once.
+    '''
+    # imported here so importing this module doesn't pull in spotipy
+    from requests.exceptions import ConnectionError, Timeout
+    from spotipy import SpotifyException
+    for attempt in range(MAX_RETRIES + 1):
+        inst.count("spotify_requests", endpoint=fn.__name__)
+        try:
+            with inst.timer("spotify_request"):
+                return fn(*args, **kwargs)
+        except SpotifyException as e:
+            if attempt == MAX_RETRIES:
+                raise
+            if e.http_status == 429:
+                inst.count("spotify_rate_limited")
+                delay = retry_after(e) + random.uniform(0, BACKOFF_BASE)
+            elif e.http_status == 401 and attempt == 0:
+                inst.count("spotify_retries", reason="unauthorized")
+                spotify.invalidate_token()
+                delay = 0
+            elif e.http_status in RETRY_STATUSES:
+                inst.count("spotify_retries", reason=str(e.http_status))
+                delay = backoff(attempt)
+            else:
+                raise
+        except (ConnectionError, Timeout):
+            if attempt == MAX_RETRIES:
+                raise
+            inst.count("spotify_retries", reason="connection")
+            delay = backoff(attempt)
+        time.sleep(delay)
+
+def backoff(attempt):
+    '''
+    Get a random delay before retry number attempt + 1.
+    '''
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def imap_unordered(fn, iterable, window=MAX_WORKERS):
+    '''
+    Run fn over an iterable on the shared pool, yielding results as they
+    finish. At most `window` calls are in flight at once, and the iterable is
+    only pulled from as slots free up, so generators can be chained through
+    this without ever holding more than a few pages in memory.
+    '''
+    iterator = iter(iterable)
+    pending = set()
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < window:
+            try:
+                pending.add(executor.submit(fn, next(iterator)))
+            except StopIteration:
+                exhausted = True
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+def retry_after(error):
+    '''
+    Get the number of seconds a 429 error asks us to wait.
+    '''
+    try:
+        return float(error.headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+# =========
+# PLAYLISTS
+# =========
+
+def parse_playlist_id(playlist_link):
+    '''
+    Get the bare playlist ID from a Spotify playlist URL, URI or ID.
+    '''
+    playlist_link = playlist_link.strip()
+    if playlist_link.startswith("spotify:"):
+        return playlist_link.split(":")[-1]
+    if "://" in playlist_link:
+        path = urlparse(playlist_link).path.rstrip("/")
+        return path.split("/")[-1]
+    return playlist_link
 
 def get_playlist_data(playlist_link):
     '''
     Get metadata + track data from a public Spotify playlist link.
+
+    Served from the playlist cache when possible, in which case each track
+    item only carries the track's URI.
     '''
-    tracks = []
+    try:
+        playlist_id = parse_playlist_id(playlist_link)
+        cached = get_cached_playlist(playlist_id)
+        if cached is not None:
+            metadata, uris = cached
+            return (metadata, [{'track': {'uri': uri}} for uri in uris if uri is not None])
+
+        results = call(client().playlist, playlist_id=playlist_id)
+        # pages arrive in any order; put them back in playlist order
+        tracks = []
+        for _, items in sorted(iter_pages(playlist_id, results), key=lambda page: page[0]):
+            tracks.extend(items)
+        metadata = get_metadata(results)
+        cache.playlist_cache.put_playlist(playlist_id, results.get('snapshot_id'), metadata, track_uris(tracks))
+    except:
+        return (None, None)
 
+    return (metadata, tracks)
+
+def get_playlist_attr_data(playlist_link, sample=True):
+    '''
+    Get metadata and aggregated audio features for a public Spotify playlist
+    link without ever holding the whole playlist in memory.
+
+    Fresh cache entries are answered from their stored sums (or estimate)
+    without touching Spotify or the feature store. Stale ones are revalidated
+    with one request, and if the playlist changed, re-blended from a diff when
+    the edit can be found from the first and last pages (see reblend).
+
+    Otherwise pages stream into track URIs, URIs into feature store lookups
+    and full batches of upstream audio-feature requests, and those into a
+    columnar AttributeTable, which is summed for the cache. Playlists longer
+    than PLAYLIST_SAMPLE_ABOVE tracks, if set, are estimated from a sample
+    instead (see estimate_attr_data), and the estimate is cached under the
+    playlist's snapshot_id; sample=False always fetches every track.
+
+    Returns a tuple of (metadata, AttributeSums or AttributeEstimate), or
+    (None, None).
+    '''
     try:
-        # get first 100 tracks + metadata
-        results = sp.playlist(playlist_id=playlist_link)
-        if (results != None and 'tracks' in results):
-            tracks.extend(results['tracks']['items'])
+        playlist_id = parse_playlist_id(playlist_link)
+        entry = cache.playlist_cache.get_playlist(playlist_id)
+        # listings without sums, and estimates when every track is wanted,
+        # can't answer this
+        if entry is not None and entry["sums"] is None and (not sample or entry.get("estimate") is None):
+            entry = None
+        if entry is None:
+            inst.count("playlist_cache", result="miss")
+        elif cache.playlist_cache.is_fresh(entry):
+            inst.count("playlist_cache", result="hit")
+            return (entry["metadata"], cached_attr_data(entry))
+
+        results = call(client().playlist, playlist_id=playlist_id)
         metadata = get_metadata(results)
+        if entry is not None:
+            if results.get('snapshot_id') == entry["snapshot_id"]:
+                inst.count("playlist_cache", result="revalidated")
+                cache.playlist_cache.touch_playlist(playlist_id, entry)
+                return (entry["metadata"], cached_attr_data(entry))
+            sums = reblend(playlist_id, entry, results, metadata) if entry["sums"] is not None else None
+            if sums is not None:
+                inst.count("playlist_cache", result="reblended")
+                return (metadata, sums)
+            inst.count("playlist_cache", result="changed")
 
-        # get first set of tracks beyond first 100 tracks, if they exist
-        if('next' in results['tracks'] and next != None):
-            results = sp.next(results['tracks'])
-            if (results != None and 'items' in results):
-                tracks.extend(results['items'])
-
-            # get any tracks beyond first 200 tracks, if they exist
-            while(results != None and 'next' in results and results['next'] != None):
-                results = sp.next(results)
-                if (results != None and 'items' in results):
-                    tracks.extend(results['items'])
+        if sample and SAMPLE_ABOVE and results['tracks']['total'] > SAMPLE_ABOVE:
+            inst.count("playlists_sampled")
+            estimate = estimate_attr_data(playlist_id, results)
+            cache.playlist_cache.put_estimate(playlist_id, results.get('snapshot_id'), metadata, estimate.to_dict())
+            return (metadata, estimate)
+
+        # one URI per playlist position, kept for the playlist cache; it's a
+        # few bytes per track, unlike the raw track JSON
+        uris = [None] * results['tracks']['total']
+        def page_uris():
+            for offset, items in iter_pages(playlist_id, results):
+                batch = item_uris(items)
+                if offset + len(batch) > len(uris):
+                    uris.extend([None] * (offset + len(batch) - len(uris)))
+                uris[offset:offset + len(batch)] = batch
+                yield [uri for uri in batch if uri is not None]
+
+        table = AttributeTable()
+        for batch in imap_unordered(resolve_features, feature_jobs(page_uris())):
+            table.add_many(batch)
+        inst.count("tracks_aggregated", table.count)
+        sums = AttributeSums.from_table(table)
+        cache.playlist_cache.put_playlist(playlist_id, results.get('snapshot_id'), metadata, uris, sums.to_dict())
     except:
         return (None, None)
-    
-    return (metadata, tracks)
+
+    return (metadata, sums)
+
+def cached_attr_data(entry):
+    '''
+    Get the AttributeSums, or the AttributeEstimate of a sampled playlist,
+    stored in a playlist cache entry.
+    '''
+    if entry["sums"] is None:
+        return AttributeEstimate.from_dict(entry["estimate"])
+    return AttributeSums.from_dict(entry["sums"])
+
+def reblend(playlist_id, entry, results, metadata):
+    '''
+    Update a changed playlist's cached sums from a diff instead of refetching
+    every page. The "Get Playlist" response already holds the first page;
+    one more request gets the last. If the edit sits within those pages
+    (tracks added or removed at either end, the usual case), only the added
+    and removed tracks are looked up, and the sums are adjusted.
+
+    Pages between the two ends are assumed unchanged once the edit is found
+    at one end, so an edit there made together with one in the middle (a
+    track appended and another replaced halfway down, say) goes unnoticed.
+    An entry is fully refetched at least every PLAYLIST_FULL_REFRESH seconds
+    regardless.
+
+    Returns the new AttributeSums, or None when a full refetch is needed.
+    '''
+    if time.time() - entry["verified_at"] > FULL_REFRESH:
+        return None
+
+    old = entry["uris"]
+    first = item_uris(results['tracks']['items'])
+    total = results['tracks']['total']
+    if total <= len(first):
+        new = first
+        removed = list((Counter(old) - Counter(new)).elements())
+        added = list((Counter(new) - Counter(old)).elements())
+    else:
+        tail_offset = max(len(first), total - PAGE_SIZE)
+        page = call(client().playlist_items, playlist_id, limit=PAGE_SIZE, offset=tail_offset)
+        inst.count("playlist_pages")
+        edit = locate_edit(old, first, item_uris(page['items']), tail_offset, total)
+        if edit is None:
+            return None
+        old_start, old_stop, added = edit
+        removed = old[old_start:old_stop]
+        new = old[:old_start] + added + old[old_stop:]
+
+    sums = AttributeSums.from_dict(entry["sums"])
+    for uris, sign in ((removed, -1), (added, 1)):
+        uris = [uri for uri in uris if uri is not None]
+        found = fetch_features(uris)
+        sums.add(AttributeTable.from_features([found[uri] for uri in uris if uri in found]), sign)
+    inst.count("tracks_reblended", len(removed) + len(added))
+    cache.playlist_cache.put_playlist(playlist_id, results.get('snapshot_id'), metadata, new, sums.to_dict(), entry["verified_at"])
+    return sums
+
+def locate_edit(old, first, tail, tail_offset, total):
+    '''
+    Find a playlist edit from its first page and the page at tail_offset,
+    given the cached URIs by position. Handles one run of added, removed or
+    replaced tracks at either end.
+
+    Returns (old_start, old_stop, added): old[old_start:old_stop] was
+    replaced by the added URIs. Returns None if the edit isn't within the
+    two pages, including when both pages match the cached URIs: the
+    playlist did change, so the edit is somewhere between them (a track
+    replaced in the middle, say).
+    '''
+    delta = total - len(old)
+    edit = None
+
+    # edit near the end: the first page is unchanged, and so is the start of
+    # the tail page, which anchors the pages in between
+    if first == old[:len(first)] and tail_offset < len(old) and tail[0] == old[tail_offset]:
+        matched = 0
+        while matched < len(tail) and tail_offset + matched < len(old) and tail[matched] == old[tail_offset + matched]:
+            matched += 1
+        edit = (tail_offset + matched, len(old), tail[matched:])
+
+    # edit near the start: the tail page and the end of the first page are
+    # the old tracks shifted by delta
+    elif tail_offset - delta >= 0 and tail == old[tail_offset - delta:]:
+        matched = 0
+        while matched < len(first) and len(first) - 1 - matched - delta >= 0 and first[-1 - matched] == old[len(first) - 1 - matched - delta]:
+            matched += 1
+        new_stop = len(first) - matched
+        if matched and new_stop - delta >= 0:
+            edit = (0, new_stop - delta, first[:new_stop])
+
+    # nothing added or removed, yet the snapshot changed
+    if edit is not None and edit[0] == edit[1] and not edit[2]:
+        return None
+    return edit
+
+def get_cached_playlist(playlist_id):
+    '''
+    Get (metadata, track URIs) for a playlist from the cache, revalidating
+    stale entries against the playlist's snapshot_id. Returns None on a miss.
+    '''
+    entry = cache.playlist_cache.get_playlist(playlist_id)
+    # a sampled playlist's entry has no listing
+    if entry is None or entry["uris"] is None:
+        inst.count("playlist_cache", result="miss")
+        return None
+    if cache.playlist_cache.is_fresh(entry):
+        inst.count("playlist_cache", result="hit")
+        return (entry["metadata"], entry["uris"])
+
+    # stale: only refetch if the playlist actually changed
+    results = call(client().playlist, playlist_id=playlist_id, fields="snapshot_id")
+    if results is not None and results.get("snapshot_id") == entry["snapshot_id"]:
+        inst.count("playlist_cache", result="revalidated")
+        cache.playlist_cache.touch_playlist(playlist_id, entry)
+        return (entry["metadata"], entry["uris"])
+    inst.count("playlist_cache", result="changed")
+    return None
+
+def iter_pages(playlist_id, first_results):
+    '''
+    Yield (offset, items) for each page of a playlist's track items,
+    starting with the page embedded in the "Get Playlist" response. That page
+    tells us the total, so the rest are requested in parallel and yielded as
+    they arrive, in no particular order.
+    '''
+    first_page = first_results['tracks']
+    inst.count("playlist_pages")
+    yield (0, first_page['items'])
+
+    def get_page(offset):
+        return (offset, call(client().playlist_items, playlist_id, limit=PAGE_SIZE, offset=offset))
+
+    offsets = range(len(first_page['items']), first_page['total'], PAGE_SIZE)
+    for offset, results in imap_unordered(get_page, offsets):
+        if results != None and 'items' in results:
+            inst.count("playlist_pages")
+            yield (offset, results['items'])
 
 def get_metadata(playlist_data):
     '''
@@ -40,43 +378,253 @@ def get_metadata(playlist_data):
     parsed_data["number_of_tracks"] = playlist_data["tracks"]["total"]
     return parsed_data
 
+def track_uris(tracks):
+    '''
+    Get the URIs of a list of playlist items, skipping removed tracks.
+    '''
+    return [track['track']['uri'] for track in tracks if track.get('track')]
+
+def item_uris(tracks):
+    '''
+    Get the URI of each of a list of playlist items, None for removed tracks.
+    '''
+    return [track['track']['uri'] if track.get('track') else None for track in tracks]
+
 def get_attr_data(tracks):
     '''
     Get all of this playlist's tracks' audio features/attributes.
+
+    Features are stored per track forever, so only tracks we haven't seen
+    before are requested from Spotify.
     '''
+    uris = track_uris(tracks)
+    uri_pages = [uris[i:i+PAGE_SIZE] for i in range(0, len(uris), PAGE_SIZE)]
     attributes = []
-    num_tracks = len(tracks)
-
-    # get track audio features 100 at a time
-    for i in range(0, num_tracks, 100):
-        batch = tracks[i:(min(num_tracks-1, i+100))]
-        batch_ids = []
-        for track in batch:
-            batch_ids.append(track['track']['uri'])
-        attributes.extend(sp.audio_features(batch_ids))
-    
+    for batch in executor.map(resolve_features, feature_jobs(uri_pages)):
+        attributes.extend(track for _, track in batch)
     return attributes
 
+def get_batch_attr_data(uris):
+    '''
+    Get the audio features of a batch of at most 100 track URIs, in order,
+    skipping tracks Spotify has no features for.
+    '''
+    found = fetch_features(uris)
+    return [found[uri] for uri in uris if uri in found]
+
+def feature_jobs(uri_pages):
+    '''
+    Turn pages of track URIs into jobs for resolve_features. Tracks already
+    in the feature store are resolved straight away; the rest are held back
+    until PAGE_SIZE distinct ones have piled up, so upstream requests go out
+    as full batches no matter how the pages split.
+
+    Yields (ready, uris) tuples: (track_id, features) pairs found in the
+    store, and track URIs still to request.
+    '''
+    pending = []
+    pending_ids = set()
+    for uris in uri_pages:
+        found = lookup_features(uris)
+        ready = [(features.track_id(uri), found[uri]) for uri in uris if uri in found]
+        for uri in uris:
+            if uri in found:
+                continue
+            if uri not in pending_ids and len(pending_ids) == PAGE_SIZE:
+                yield (ready, pending)
+                ready, pending, pending_ids = [], [], set()
+            pending.append(uri)
+            pending_ids.add(uri)
+        if ready:
+            yield (ready, [])
+    if pending:
+        yield ([], pending)
+
+def resolve_features(job):
+    '''
+    Finish a feature_jobs job, requesting its missing tracks from Spotify.
+    Returns the job's (track_id, features) pairs, skipping tracks Spotify has
+    no features for.
+    '''
+    ready, uris = job
+    if not uris:
+        return ready
+    fetched = request_features(list(dict.fromkeys(uris)))
+    return ready + [(features.track_id(uri), fetched[uri]) for uri in uris if uri in fetched]
+
+def fetch_features(uris):
+    '''
+    Get the audio features we use for a list of track URIs as a dict of
+    uri -> features. Stored tracks are served from the feature store and the
+    rest are requested 100 at a time.
+    '''
+    found = lookup_features(uris)
+    missing = list(dict.fromkeys(uri for uri in uris if uri not in found))
+    found.update(request_features(missing))
+    return found
+
+def lookup_features(uris):
+    '''
+    Get the stored features of track URIs as a dict of uri -> features.
+    '''
+    found = features.feature_store.get_many(uris)
+    inst.count("feature_cache", len(found), result="hit")
+    inst.count("feature_cache", len(set(uris)) - len(found), result="miss")
+    return found
+
+def request_features(uris):
+    '''
+    Request audio features for distinct track URIs from Spotify, 100 at a
+    time, and store them. Returns a dict of uri -> features.
+    '''
+    fetched = {}
+    for i in range(0, len(uris), 100):
+        batch_ids = uris[i:i+100]
+        for uri, attributes in zip(batch_ids, call(client().audio_features, batch_ids)):
+            if attributes is not None:
+                fetched[uri] = {name: attributes[name] for name in ATTRIBUTES}
+    features.feature_store.put_many(fetched)
+    return fetched
+
 def get_avg_attr_data(attributes):
     '''
     Get the average of this playlist's audio attribute data.
     '''
-    num_tracks = len(attributes)
-    valence_sum = 0
-    energy_sum = 0
-    acousticness_sum = 0
-    tempo_sum = 0
-    
-    for track in attributes:
-        valence_sum += track["valence"]
-        energy_sum += track["energy"]
-        acousticness_sum += track["acousticness"]
-        tempo_sum += track["tempo"]
-    
-    averages = {}
-    averages["valence"] = round(valence_sum / num_tracks, 3)
-    averages["energy"] = round(energy_sum / num_tracks, 3)
-    averages["acousticness"] = round(acousticness_sum / num_tracks, 3)
-    averages["tempo"] = round(tempo_sum / num_tracks, 3)
-
-    return averages
\ No newline at end of file
+    return AttributeTable.from_features(attributes).averages()
+
+# ========
+# SAMPLING
+# ========
+
+# Playlists with more than PLAYLIST_SAMPLE_ABOVE tracks (if set) have their
+# attribute means estimated from a sample of their pages instead. The sample
+# grows until the gradient inputs are pinned down to PLAYLIST_SAMPLE_TOLERANCE
+# at PLAYLIST_SAMPLE_CONFIDENCE, but never past PLAYLIST_SAMPLE_MAX_TRACKS,
+# which caps the requests a playlist costs however long it is.
+SAMPLE_ABOVE = int(getenv("PLAYLIST_SAMPLE_ABOVE", 0))
+SAMPLE_MAX_TRACKS = int(getenv("PLAYLIST_SAMPLE_MAX_TRACKS", 2000))
+SAMPLE_TOLERANCE = float(getenv("PLAYLIST_SAMPLE_TOLERANCE", 0.01))
+SAMPLE_CONFIDENCE = float(getenv("PLAYLIST_SAMPLE_CONFIDENCE", 0.95))
+
+# pages drawn in the first round, and at least in every later one
+SAMPLE_ROUND = 8
+
+# How the gradient inputs move with the means (see
+# gradient_generator.attr_to_gen_input): hue one-for-one with valence, value
+# by .4 of it, saturation by .65 energy - .35 acousticness, and the hue range
+# steps every TEMPO_STEP bpm above TEMPO_BASE.
+SATURATION_WEIGHTS = {"energy": .65, "acousticness": -.35}
+VALUE_WEIGHT = .4
+TEMPO_BASE = 90
+TEMPO_STEP = 20
+
+def estimate_attr_data(playlist_id, results, tolerance=None, confidence=None, max_tracks=None):
+    '''
+    Estimate a playlist's attribute means from a stratified random sample of
+    its pages, given its "Get Playlist" response.
+
+    Pages are drawn in rounds. Each round splits the pages not drawn yet
+    into equal runs of offsets and draws one at random from each, so the
+    sample covers the whole playlist. After each round, sampling stops if
+    the hue, saturation and value the means give are known to within
+    `tolerance` and the tempo's hue range to a single step; otherwise the
+    next round is sized from how far off that is. If PLAYLIST_SAMPLE_MAX_TRACKS
+    runs out first, the estimate is returned anyway, flagged as not
+    converged.
+
+    The draw is seeded with the playlist's snapshot_id, so a given version of
+    a playlist always gets the same estimate, and so the same images.
+
+    Returns an AttributeEstimate.
+    '''
+    tolerance = SAMPLE_TOLERANCE if tolerance is None else tolerance
+    confidence = SAMPLE_CONFIDENCE if confidence is None else confidence
+    max_tracks = SAMPLE_MAX_TRACKS if max_tracks is None else max_tracks
+
+    total = results['tracks']['total']
+    first_page = item_uris(results['tracks']['items'])
+    population = -(-total // PAGE_SIZE)
+    max_pages = max(2, max_tracks // PAGE_SIZE)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    rng = random.Random(f"{playlist_id}:{results.get('snapshot_id')}")
+
+    def get_page(index):
+        # the first page came with the playlist
+        if index == 0 and len(first_page) >= min(PAGE_SIZE, total):
+            return first_page
+        inst.count("playlist_pages")
+        return item_uris(call(client().playlist_items, playlist_id, limit=PAGE_SIZE, offset=index * PAGE_SIZE)['items'])
+
+    undrawn = list(range(population))
+    pages = []
+    found = {}
+    draw = SAMPLE_ROUND
+    while True:
+        chosen = stratified_draw(undrawn, min(draw, max_pages - len(pages)), rng)
+        drawn = set(chosen)
+        undrawn = [index for index in undrawn if index not in drawn]
+        round_pages = [[uri for uri in uris if uri is not None] for uris in imap_unordered(get_page, chosen)]
+        for batch in imap_unordered(resolve_features, feature_jobs(round_pages)):
+            found.update(batch)
+        pages.extend(round_pages)
+
+        means, errors, shortfall = sample_estimate(pages, found, population, z, tolerance)
+        if shortfall <= 1 or not undrawn or len(pages) >= max_pages:
+            break
+        draw = max(SAMPLE_ROUND, math.ceil(len(pages) * (shortfall - 1)))
+
+    count = sum(1 for uris in pages for uri in uris if features.track_id(uri) in found)
+    inst.count("tracks_sampled", count)
+    # every page drawn is an exact answer, however wide the bound looks
+    converged = shortfall <= 1 or not undrawn
+    if not converged:
+        inst.count("playlist_samples_capped")
+    return AttributeEstimate(
+        {name: means[name] for name in ATTRIBUTES},
+        {name: errors[name] for name in ATTRIBUTES},
+        count, total, confidence, converged,
+    )
+
+def stratified_draw(indices, count, rng):
+    '''
+    Draw `count` of a sorted list of indices, one at random from each of
+    `count` equal runs.
+    '''
+    count = min(count, len(indices))
+    return [rng.choice(indices[i * len(indices) // count:(i + 1) * len(indices) // count]) for i in range(count)]
+
+def sample_estimate(pages, found, population, z, tolerance):
+    '''
+    Estimate the attribute means (and the saturation term) from sampled
+    pages of track URIs, given their features by track ID.
+
+    Returns (means, errors, shortfall): dicts of estimates and confidence
+    half-widths, and roughly how many times larger the sample has to be for
+    the gradient inputs to be pinned down (1 or less when they are).
+    '''
+    quantities = ATTRIBUTES + ("saturation",)
+    sums = np.zeros((len(pages), len(quantities)))
+    sizes = np.zeros(len(pages))
+    for row, uris in enumerate(pages):
+        table = AttributeTable.from_features([found[features.track_id(uri)] for uri in uris if features.track_id(uri) in found])
+        if table.count == 0:
+            continue
+        columns = {name: column.astype(np.float64) for name, column in table.columns.items()}
+        columns["saturation"] = sum(weight * columns[name] for name, weight in SATURATION_WEIGHTS.items())
+        sums[row] = [columns[name].sum() for name in quantities]
+        sizes[row] = table.count
+    if sizes.sum() == 0:
+        raise ValueError("No audio features in the sample")
+
+    means, errors = (dict(zip(quantities, values.tolist())) for values in ratio_estimate(sums, sizes, population, z))
+    hsv_error = max(errors["valence"], VALUE_WEIGHT * errors["valence"], errors["saturation"])
+    shortfall = (hsv_error / tolerance) ** 2
+
+    # the hue range is settled once the tempo interval is inside one step
+    low, high = means["tempo"] - errors["tempo"], means["tempo"] + errors["tempo"]
+    if max(1, (low - TEMPO_BASE) // TEMPO_STEP) != max(1, (high - TEMPO_BASE) // TEMPO_STEP):
+        # the nearest step that changes the range; it's 1 up to two steps
+        edge = TEMPO_BASE + TEMPO_STEP * max(2, round((means["tempo"] - TEMPO_BASE) / TEMPO_STEP))
+        margin = abs(means["tempo"] - edge)
+        shortfall = max(shortfall, (errors["tempo"] / margin) ** 2 if margin else math.inf)
+    return means, errors, shortfall
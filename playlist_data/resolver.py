@@ -0,0 +1,212 @@
+from playlist_data import playlist_data as pd
+from playlist_data.aggregate import AttributeSums, AttributeTable
+from collections import Counter
+from instrumentation import instrumentation as inst
+from os import getenv
+from urllib.parse import urlparse
+import re
+
+'''
+Resolver for any public Spotify link: playlists, albums, tracks and artists
+(their top tracks), one or several at once, separated by spaces, commas or
+newlines:
+
+    https://open.spotify.com/album/4aawyAB9vmqN3uQ7FjRGTy
+    spotify:track:6rqhFgbbKwnb9MLmUQDhG6 spotify:artist:0OdUWJ0sBjDrqHygGUXeCF
+
+Links are grouped by type and fetched through Spotify's multi-ID endpoints,
+20 albums or 50 tracks a request, so 50 albums cost a handful of requests
+rather than one each. Their tracks then go through the same feature store
+lookups and 100-track audio-feature batches as playlist tracks, and into the
+same AttributeSums. Playlists go through get_playlist_attr_data, cache and
+all; a single playlist link behaves exactly as it always has.
+
+Configured with environment variables:
+    SPOTIFY_MARKET: country whose top tracks are used for artists
+'''
+TYPES = ("playlist", "album", "track", "artist")
+ALBUMS_PER_REQUEST = 20
+TRACKS_PER_REQUEST = 50
+ALBUM_PAGE_SIZE = 50
+MARKET = getenv("SPOTIFY_MARKET", "US")
+
+# =========
+#   LINKS
+# =========
+
+def parse_link(link) -> tuple[str, str]:
+    '''
+    Get the (type, id) of a Spotify URL or URI. A bare ID is taken to be a
+    playlist. Raises ValueError for other kinds of links.
+    '''
+    link = link.strip()
+    if link.startswith("spotify:"):
+        parts = link.split(":")
+    elif "://" in link:
+        parts = [part for part in urlparse(link).path.split("/") if part]
+    else:
+        return ("playlist", link)
+    # the type comes right before the ID, after any locale or user prefix
+    if len(parts) >= 2 and parts[-2] in TYPES:
+        return (parts[-2], parts[-1])
+    raise ValueError(f"Not a Spotify playlist, album, track or artist: {link}")
+
+def parse_links(text) -> list[tuple[str, str]]:
+    '''
+    Get the (type, id) of every link in a string, in order, without
+    duplicates. Raises ValueError if there are none.
+    '''
+    items = list(dict.fromkeys(parse_link(link) for link in re.split(r"[\s,]+", text or "") if link))
+    if not items:
+        raise ValueError("No Spotify links given")
+    return items
+
+def link_key(items) -> str:
+    '''
+    A string identifying a set of parsed links, e.g. for request coalescing.
+    '''
+    return " ".join(f"{type}:{id}" for type, id in items)
+
+def blend_key(items) -> str:
+    '''
+    The key a set of parsed links is stored under in the blend index: a
+    single playlist's bare ID, as batch runs store them, or its link_key.
+    '''
+    if len(items) == 1 and items[0][0] == "playlist":
+        return items[0][1]
+    return link_key(items)
+
+# ============
+#   FETCHING
+# ============
+
+def chunks(ids, size):
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+def fetch_albums(album_ids):
+    '''
+    Get album objects, 20 a request. Returns (albums, uris): the albums
+    found, and the track URIs of all of them.
+    '''
+    albums = []
+    for batch in pd.imap_unordered(lambda ids: pd.call(pd.client().albums, ids)['albums'], chunks(album_ids, ALBUMS_PER_REQUEST)):
+        albums.extend(album for album in batch if album)
+
+    # album objects carry their first 50 tracks; longer albums are paged
+    uris = [track['uri'] for album in albums for track in album['tracks']['items']]
+    pages = [
+        (album['id'], offset)
+        for album in albums
+        for offset in range(len(album['tracks']['items']), album['tracks']['total'], ALBUM_PAGE_SIZE)
+    ]
+    def get_page(page):
+        album_id, offset = page
+        return pd.call(pd.client().album_tracks, album_id, limit=ALBUM_PAGE_SIZE, offset=offset)['items']
+    for items in pd.imap_unordered(get_page, pages):
+        uris.extend(track['uri'] for track in items)
+    return (albums, uris)
+
+def fetch_tracks(track_ids):
+    '''
+    Get track objects, 50 a request, skipping IDs Spotify doesn't know.
+    '''
+    tracks = []
+    for batch in pd.imap_unordered(lambda ids: pd.call(pd.client().tracks, ids)['tracks'], chunks(track_ids, TRACKS_PER_REQUEST)):
+        tracks.extend(track for track in batch if track)
+    return tracks
+
+def fetch_top_tracks(artist_ids):
+    '''
+    Get each artist's top tracks, as a dict of artist ID -> track objects.
+    There's no multi-artist endpoint for these, so it's one request each.
+    '''
+    def get_top_tracks(artist_id):
+        return (artist_id, pd.call(pd.client().artist_top_tracks, artist_id, country=MARKET)['tracks'])
+    return dict(pd.imap_unordered(get_top_tracks, artist_ids))
+
+# =============
+#   RESOLVING
+# =============
+
+def get_link_attr_data(text):
+    '''
+    Get metadata and aggregated audio features for one or more Spotify links.
+
+    Returns a tuple of (metadata, AttributeSums), or (None, None).
+    '''
+    try:
+        items = parse_links(text)
+    except ValueError:
+        return (None, None)
+    return get_items_attr_data(items)
+
+def get_items_attr_data(items):
+    '''
+    Get metadata and aggregated audio features for parsed (type, id) links.
+
+    Returns a tuple of (metadata, AttributeSums), or (None, None) if any of
+    them can't be read.
+    '''
+    if len(items) == 1 and items[0][0] == "playlist":
+        return pd.get_playlist_attr_data(items[0][1])
+
+    try:
+        ids = {type: [id for item_type, id in items if item_type == type] for type in TYPES}
+        inst.count("links_resolved", len(items))
+        names = {}
+        uris = []
+
+        albums, album_uris = fetch_albums(ids["album"])
+        for album in albums:
+            names[("album", album['id'])] = (album['name'], artist_names(album))
+        uris.extend(album_uris)
+
+        for track in fetch_tracks(ids["track"]):
+            names[("track", track['id'])] = (track['name'], artist_names(track))
+            uris.append(track['uri'])
+
+        for artist_id, tracks in fetch_top_tracks(ids["artist"]).items():
+            artist = next((a['name'] for track in tracks for a in track['artists'] if a.get('id') == artist_id), None)
+            names[("artist", artist_id)] = (f"{artist or 'Artist'} top tracks", artist or "Spotify")
+            uris.extend(track['uri'] for track in tracks)
+
+        # every track played by a playlist counts, like within one
+        sums = AttributeSums()
+        for playlist_id in ids["playlist"]:
+            metadata, playlist_sums = pd.get_playlist_attr_data(playlist_id, sample=False)
+            if metadata is None:
+                return (None, None)
+            names[("playlist", playlist_id)] = (metadata["playlist_title"], metadata["playlist_owner"])
+            sums.combine(playlist_sums)
+
+        table = AttributeTable()
+        for batch in pd.imap_unordered(pd.resolve_features, pd.feature_jobs(chunks(uris, pd.PAGE_SIZE))):
+            table.add_many(batch)
+        inst.count("tracks_aggregated", table.count)
+        sums.add(table)
+    except:
+        return (None, None)
+
+    return (describe(items, names, sums.count), sums)
+
+def artist_names(item):
+    return ", ".join(artist['name'] for artist in item['artists'])
+
+def describe(items, names, count):
+    '''
+    Build playlist-style metadata for a set of links: a single item's own
+    name and artist, or a summary like "3 albums, 1 track".
+    '''
+    found = [names[item] for item in items if item in names]
+    if len(items) == 1 and found:
+        title, owner = found[0]
+    else:
+        counts = Counter(type for type, _ in items)
+        title = ", ".join(f"{n} {type}{'s' if n > 1 else ''}" for type, n in counts.items())
+        owners = list(dict.fromkeys(owner for _, owner in found))
+        owner = ", ".join(owners[:3]) + (" and others" if len(owners) > 3 else "")
+    return {
+        "playlist_title": title,
+        "playlist_owner": owner,
+        "number_of_tracks": count,
+    }
@@ -0,0 +1,192 @@
+from instrumentation import instrumentation as inst
+from os import getenv
+import threading
+import time
+
+'''
+Process-wide Spotify client and the transport under it, created on first use.
+
+Importing spotipy (and with it requests and redis) and reading credentials
+are a large share of a cold start, so none of it happens until the first
+request needs the client, or warm_up() asks for it ahead of time.
+
+Every thread shares one requests session, whose connection pool keeps up to
+SPOTIFY_POOL_SIZE keep-alive connections per host open, so requests don't
+each pay for a TLS handshake. Responses are gzip-compressed, and every
+request has connect and read timeouts.
+
+The client-credentials token is held in memory and shared by every thread
+too. It's refreshed SPOTIFY_TOKEN_REFRESH_MARGIN seconds before it expires,
+by whichever thread notices first while the others keep using the current
+one. (spotipy's default keeps it in a .cache file it re-reads on every
+request, and lets every thread refresh at once.) Retries are up to
+playlist_data.call.
+
+Configured with environment variables (or a .env file):
+    SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET: app credentials
+    SPOTIFY_POOL_SIZE: connections kept open per host
+    SPOTIFY_CONNECT_TIMEOUT, SPOTIFY_READ_TIMEOUT: request timeouts in seconds
+    SPOTIFY_TOKEN_REFRESH_MARGIN: seconds before expiry to refresh the token
+    SPOTIFY_API_URL, SPOTIFY_TOKEN_URL: endpoints, e.g. to point at a stub
+        server such as benchmarks.fake_spotify
+'''
+API_URL = "https://api.spotify.com/v1/"
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_REFRESH_MARGIN = 300
+
+# =============
+#   TRANSPORT
+# =============
+
+def make_session(pool_size=DEFAULT_POOL_SIZE):
+    '''
+    Build a requests session with a keep-alive connection pool of pool_size
+    connections per host.
+    '''
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    # one pool each for the API and the token endpoint; no retries here, as
+    # playlist_data.call retries with backoff and honors Retry-After
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+    return session
+
+class TokenManager:
+    '''
+    Client-credentials access token shared by every thread. Works as a
+    spotipy auth_manager.
+    '''
+
+    def __init__(self, client_id, client_secret, session, token_url=TOKEN_URL,
+                 timeout=(DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT), refresh_margin=DEFAULT_REFRESH_MARGIN):
+        if not client_id or not client_secret:
+            raise ValueError("SPOTIPY_CLIENT_ID and SPOTIPY_CLIENT_SECRET must be set")
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.session = session
+        self.token_url = token_url
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+        # (token, expires_at), swapped as a whole so readers never need the lock
+        self._current = (None, 0.0)
+        self._lock = threading.Lock()
+
+    def get_access_token(self, as_dict=False):
+        token, expires_at = self._current
+        now = time.time()
+        if token is not None and now < expires_at - self.refresh_margin:
+            return token
+
+        if token is not None and now < expires_at:
+            # due for a refresh but still valid: refresh it unless another
+            # thread already is, and keep using it meanwhile
+            if self._lock.acquire(blocking=False):
+                try:
+                    if self._current[0] == token:
+                        self._refresh()
+                except Exception:
+                    inst.count("spotify_token_refresh_failed")
+                finally:
+                    self._lock.release()
+            return self._current[0]
+
+        with self._lock:
+            token, expires_at = self._current
+            if token is None or time.time() >= expires_at:
+                self._refresh()
+            return self._current[0]
+
+    def invalidate(self):
+        '''
+        Drop the current token, e.g. after Spotify rejects it.
+        '''
+        with self._lock:
+            self._current = (None, 0.0)
+
+    def _refresh(self):
+        inst.count("spotify_token_refreshes")
+        with inst.timer("spotify_token"):
+            response = self.session.post(
+                self.token_url,
+                data={"grant_type": "client_credentials"},
+                auth=(self.client_id, self.client_secret),
+                timeout=self.timeout,
+            )
+        response.raise_for_status()
+        info = response.json()
+        self._current = (info["access_token"], time.time() + info["expires_in"])
+
+# ==========
+#   CLIENT
+# ==========
+
+_client = None
+_lock = threading.Lock()
+
+def build_client(client_id=None, client_secret=None, api_url=None, token_url=None, pool_size=None,
+                 connect_timeout=None, read_timeout=None, refresh_margin=None):
+    '''
+    Build a spotipy client on a pooled session and a shared token. Options
+    left as None come from the environment.
+    '''
+    import spotipy
+
+    session = make_session(pool_size or int(getenv("SPOTIFY_POOL_SIZE", DEFAULT_POOL_SIZE)))
+    timeout = (
+        connect_timeout or float(getenv("SPOTIFY_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+        read_timeout or float(getenv("SPOTIFY_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+    )
+    tokens = TokenManager(
+        client_id or getenv("SPOTIPY_CLIENT_ID"),
+        client_secret or getenv("SPOTIPY_CLIENT_SECRET"),
+        session,
+        token_url=token_url or getenv("SPOTIFY_TOKEN_URL", TOKEN_URL),
+        timeout=timeout,
+        refresh_margin=refresh_margin if refresh_margin is not None else float(getenv("SPOTIFY_TOKEN_REFRESH_MARGIN", DEFAULT_REFRESH_MARGIN)),
+    )
+    client = spotipy.Spotify(auth_manager=tokens, requests_session=session, requests_timeout=timeout)
+    client.prefix = api_url or getenv("SPOTIFY_API_URL", API_URL)
+    return client
+
+def get_client():
+    '''
+    Get the shared spotipy client, creating it on the first call.
+    '''
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from dotenv import load_dotenv
+                load_dotenv()
+                _client = build_client()
+    return _client
+
+def configure(**options):
+    '''
+    Replace the process-wide client; takes the same options as build_client.
+    '''
+    global _client
+    with _lock:
+        _client = build_client(**options)
+    return _client
+
+def invalidate_token():
+    '''
+    Drop the shared client's token so the next request fetches a new one.
+    '''
+    if _client is not None:
+        _client.auth_manager.invalidate()
+
+def warm_up():
+    '''
+    Create the client and fetch an access token, so the first real request
+    doesn't wait on either.
+    '''
+    get_client().auth_manager.get_access_token(as_dict=False)
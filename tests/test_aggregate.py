@@ -0,0 +1,30 @@
+from playlist_data.aggregate import ATTRIBUTES, AttributeEstimate, AttributeTable
+import json
+import numpy as np
+
+def features(i):
+    return {"valence": i / 250, "energy": 1 - i / 250, "acousticness": 0.5, "tempo": 60.0 + i, "loudness": -5.0}
+
+def test_add_many_batches():
+    table = AttributeTable()
+    for start in range(0, 250, 100):
+        table.add_many((f"t{i}", features(i)) for i in range(start, min(start + 100, 250)))
+    whole = AttributeTable.from_features([features(i) for i in range(250)], [f"t{i}" for i in range(250)])
+    assert table.count == 250
+    assert list(table.track_ids) == list(whole.track_ids)
+    for name in ATTRIBUTES:
+        np.testing.assert_array_equal(table.columns[name], whole.columns[name])
+        assert table.columns[name].dtype == np.float32
+    # adding after a read appends to the joined columns
+    table.add_many([("t250", features(250))])
+    assert table.count == 251 and table.track_ids[-1] == b"t250"
+
+def test_estimate_round_trip():
+    estimate = AttributeEstimate(
+        {"valence": 0.4, "energy": 0.6, "acousticness": 0.2, "tempo": 121.5},
+        {"valence": 0.01, "energy": 0.02, "acousticness": 0.0, "tempo": float("inf")},
+        2000, 50000, 0.95, converged=False,
+    )
+    copy = AttributeEstimate.from_dict(json.loads(json.dumps(estimate.to_dict())))
+    assert copy.averages() == estimate.averages()
+    assert copy.report() == estimate.report()
@@ -0,0 +1,22 @@
+from gradient_generator import animate, encode
+from PIL import Image
+import io
+import numpy as np
+import pytest
+
+@pytest.mark.parametrize("tempo", [0, -120, float("inf"), float("-inf"), float("nan")])
+def test_frame_duration_rejects_bad_tempos(tempo):
+    with pytest.raises(ValueError):
+        animate.frame_duration(tempo)
+
+def test_webp_frames():
+    colors = [(255, 0, 0), (0, 0, 255)]
+    encoding = encode.animation_encoding("webp", quality=None)
+    data = animate.render_animation("radial", *colors, 120, frames=8, size=48, encoding=encoding).getvalue()
+    image = Image.open(io.BytesIO(data))
+    assert image.n_frames == 8 and image.size == (48, 48)
+    for frame, expected in enumerate(animate.iter_frames("radial", colors, "pulse", frames=8, size=48)):
+        image.seek(frame)
+        image.load()
+        assert image.info["duration"] == animate.frame_duration(120, 8)
+        np.testing.assert_array_equal(np.asarray(image.convert("RGB")), expected)
@@ -0,0 +1,32 @@
+from playlist_data import features
+import io
+import pytest
+
+ROWS = {
+    f"spotify:track:{i}": {"tempo": 60.0 + i, "valence": 0.35, "energy": i / 7, "acousticness": 0.0}
+    for i in range(1200)
+}
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return features.FeatureStore(features.MemoryBackend())
+    return features.FeatureStore(features.backend_from_url(f"sqlite:///{tmp_path / 'features.db'}"))
+
+def test_round_trip(store):
+    store.put_many(ROWS)
+    found = store.get_many(list(ROWS) + ["spotify:track:missing"])
+    assert set(found) == set(ROWS)
+    for uri, row in ROWS.items():
+        assert found[uri] == features.unpack(features.pack(row))
+    assert store.stats()["tracks"] == len(ROWS)
+    assert (store.hits, store.misses) == (len(ROWS), 1)
+
+def test_export_import(store):
+    store.put_many(ROWS)
+    f = io.StringIO()
+    assert store.export_csv(f) == len(ROWS)
+    copy = features.FeatureStore(features.MemoryBackend())
+    f.seek(0)
+    assert copy.import_csv(f) == len(ROWS)
+    assert copy.get_many(ROWS) == store.get_many(ROWS)
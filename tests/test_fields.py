@@ -0,0 +1,20 @@
+import numpy as np
+from gradient_generator import engine
+
+COLORS = [[0.05, 0.8, 0.6], [0.7, 0.4, 0.95]]
+
+def test_indexed_fields_match_analytic_render():
+    for shape in engine.SHAPES:
+        field = engine.index_field(np.ascontiguousarray(engine.param_field(shape, 300, 300)))
+        assert field[1].dtype == np.uint16
+        for space in engine.SPACES:
+            indexed = engine.render_ramp(shape, COLORS, 300, 300, space, field)
+            assert np.array_equal(indexed, engine.render_ramp(shape, COLORS, 300, 300, space))
+
+def test_quantized_fields_are_within_one_level():
+    field = engine.index_field(np.ascontiguousarray(engine.param_field("conic", 640, 640)))
+    assert field[0] is engine.LEVEL_VALUES
+    assert field[1].dtype == np.uint16
+    quantized = engine.render_ramp("conic", COLORS, 640, 640, "hsv", field)
+    exact = engine.render_ramp("conic", COLORS, 640, 640, "hsv")
+    assert np.abs(quantized.astype(int) - exact).max() <= 1
@@ -0,0 +1,43 @@
+from playlist_data import playlist_data as pd
+
+def uris(indices):
+    return [f"spotify:track:{i}" for i in indices]
+
+def located(old, new):
+    '''
+    Run locate_edit on the pages reblend would fetch for a playlist edited
+    from `old` to `new`.
+    '''
+    first = new[:pd.PAGE_SIZE]
+    tail_offset = max(len(first), len(new) - pd.PAGE_SIZE)
+    tail = new[tail_offset:tail_offset + pd.PAGE_SIZE]
+    return pd.locate_edit(old, first, tail, tail_offset, len(new))
+
+def applied(old, edit):
+    old_start, old_stop, added = edit
+    return old[:old_start] + added + old[old_stop:]
+
+def test_locate_edit_append():
+    old = uris(range(5000))
+    new = old + uris([5000, 5001])
+    edit = located(old, new)
+    assert edit == (5000, 5000, uris([5000, 5001]))
+    assert applied(old, edit) == new
+
+def test_locate_edit_remove_first():
+    old = uris(range(5000))
+    new = old[1:]
+    edit = located(old, new)
+    assert edit == (0, 1, [])
+    assert applied(old, edit) == new
+
+def test_locate_edit_replace_middle():
+    # both pages are unchanged, so the edit can't be found from them
+    old = uris(range(5000))
+    new = old[:2500] + uris([9999]) + old[2501:]
+    assert located(old, new) is None
+
+def test_locate_edit_insert_middle_remove_end():
+    old = uris(range(5000))
+    new = old[:2500] + uris([9999]) + old[2500:-1]
+    assert located(old, new) is None